@@ -9,8 +9,35 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangodelights.settings')
 
-application = get_asgi_application()
+
+# Django's ASGI handler resolving every request against asgi_urls.py,
+# which serves the async variants of the read-heavy views, in place of
+# ROOT_URLCONF
+class AsyncViewsHandler(ASGIHandler):
+    urlconf = 'djangodelights.asgi_urls'
+
+    async def get_response_async(self, request):
+        request.urlconf = self.urlconf
+        return await super().get_response_async(request)
+
+
+django.setup(set_prefix=False)
+django_application = AsyncViewsHandler()
+
+# imported once Django is set up
+from inventory.live import STREAM_PATH, availability_stream  # noqa: E402
+
+
+# the live stock feed streams from its own ASGI application, everything
+# else is served by Django
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+        await availability_stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
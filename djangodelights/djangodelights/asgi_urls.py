@@ -0,0 +1,12 @@
+"""djangodelights URL Configuration under ASGI
+
+The same urls as djangodelights/urls.py, with the inventory's read-heavy
+pages served by async views (see inventory/asyncviews.py).
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path('', include('inventory.async_urls')),
+    path('admin/', admin.site.urls),
+]
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
+
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inventory.profiler.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,9 +81,105 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # a second connection to the same file standing in for a read replica,
+    # only read from when INVENTORY_REPLICA names it (see inventory/routers.py)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    },
+}
+
+# Database profile, chosen with INVENTORY_DB_PROFILE: 'production' keeps
+# connections open between requests and tunes SQLite for concurrent writers
+# the pragmas and BEGIN mode are applied to each connection as it opens
+# (see inventory/signals.py)
+
+SQLITE_PROFILES = {
+    'development': {'CONN_MAX_AGE': 0, 'PRAGMAS': {}, 'BEGIN': None},
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'PRAGMAS': {
+            # readers don't block the writer, and commits don't wait for fsync
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            # milliseconds to wait for another connection's write lock
+            'busy_timeout': 10000,
+            # 64 MB page cache (a negative size is in KiB), 256 MB mmap
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+        },
+        # take the write lock when a transaction begins, so one that reads
+        # then writes waits its turn instead of failing as "database is locked"
+        'BEGIN': 'IMMEDIATE',
+    },
+}
+
+INVENTORY_DB_PROFILE = os.environ.get('INVENTORY_DB_PROFILE', 'development')
+INVENTORY_SQLITE = SQLITE_PROFILES[INVENTORY_DB_PROFILE]
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = INVENTORY_SQLITE['CONN_MAX_AGE']
+
+# PostgreSQL in place of SQLite: set POSTGRES_DB, and POSTGRES_USER,
+# POSTGRES_PASSWORD, POSTGRES_HOST and POSTGRES_PORT as needed
+# connections are kept open for POSTGRES_CONN_MAX_AGE seconds; behind a
+# transaction pooler such as PgBouncer set POSTGRES_POOLER=1, as server-side
+# cursors can't outlive the pooled transaction
+# POSTGRES_REPLICA_HOST (and POSTGRES_REPLICA_PORT) adds a read replica for
+# the reports and exports
+
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', ''),
+        'PORT': os.environ.get('POSTGRES_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600)),
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_POOLER') == '1',
+        'OPTIONS': {'connect_timeout': 5},
+    }
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('POSTGRES_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
     }
+
+# database alias the reports and exports read from, if not the primary
+INVENTORY_REPLICA = os.environ.get('INVENTORY_REPLICA') or (
+    'replica' if os.environ.get('POSTGRES_REPLICA_HOST') else None
+)
+
+DATABASE_ROUTERS = ['inventory.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# the 'inventory' cache holds versioned pages and availability maps
+# (see inventory/cache.py); local memory is per process, so set
+# INVENTORY_CACHE_DIR to share a file-based cache between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'inventory': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'inventory',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
 }
 
+if os.environ.get('INVENTORY_CACHE_DIR'):
+    CACHES['inventory'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['INVENTORY_CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -137,3 +236,23 @@ SESSION_COOKIE_SECURE = True
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Query profiler middleware: per-view query counts and Server-Timing headers
+# served to staff at /profiler/ (see inventory/profiler.py)
+
+INVENTORY_PROFILER = os.environ.get('INVENTORY_PROFILER') == '1'
+
+
+# Async views: under ASGI the read-heavy pages run their queries on a pool
+# of this many threads (see inventory/asyncviews.py); 0 runs them in the
+# request's thread
+
+INVENTORY_ASYNC_THREADS = int(os.environ.get('INVENTORY_ASYNC_THREADS', 8))
+
+
+# Stock writes: with INVENTORY_APPEND_STOCK=1 sales, deliveries and waste
+# only append to the stock ledger as they happen, and ingredient quantities
+# are refreshed from it after each commit (see inventory/models.py)
+
+INVENTORY_APPEND_STOCK = os.environ.get('INVENTORY_APPEND_STOCK') == '1'
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from .models import Basket, Category, Ingredient, MenuItem
 from .models import Purchase, Recipe, OrderNumber, Order
-from .models import Table, TableOrder
+from .models import Table, TableOrder, StockTake, StockAdjustment
+from .models import StockMovement, StockSnapshot
 
 # Register your models here.
 admin.site.register(Basket)
@@ -14,3 +15,21 @@ admin.site.register(Order)
 admin.site.register(OrderNumber)
 admin.site.register(Table)
 admin.site.register(TableOrder)
+admin.site.register(StockTake)
+admin.site.register(StockAdjustment)
+
+
+# the stock ledger is append-only, so it can be viewed but not edited
+class LedgerAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(StockMovement, LedgerAdmin)
+admin.site.register(StockSnapshot, LedgerAdmin)
@@ -0,0 +1,26 @@
+from django.urls import URLPattern
+
+from . import asyncviews
+from .urls import urlpatterns as sync_urlpatterns
+
+# url name: async variant served in its place
+ASYNC_VIEWS = {
+    'menu': asyncviews.MenuView,
+    'report': asyncviews.ReportView,
+    'best_sellers': asyncviews.BestSellerView,
+    'table_order': asyncviews.TableOrderView,
+    'current_stock': asyncviews.CurrentStockView,
+}
+
+# inventory/urls.py with the read-heavy views swapped for their async
+# variants, for the ASGI application
+urlpatterns = [
+    URLPattern(
+        pattern.pattern,
+        ASYNC_VIEWS[pattern.name].as_view(),
+        pattern.default_args,
+        pattern.name,
+    )
+    if getattr(pattern, 'name', None) in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+]
@@ -0,0 +1,111 @@
+import asyncio
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import views
+from .forms import BestSellerFilterForm
+
+
+# Async variants of the read-heavy views, served by the ASGI application
+# (see djangodelights/asgi_urls.py)
+# Django 3.2 has no async ORM, and sync views under ASGI all share one
+# thread, so one slow report holds up every other page; these views run
+# their queries and template rendering on a bounded pool of threads
+# instead, independent queries side by side, leaving the event loop free
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.INVENTORY_ASYNC_THREADS,
+            thread_name_prefix='inventory-async',
+        )
+    return _executor
+
+
+# each pool thread has its own connection, closed when too old
+# or broken as at the end of a request
+def _run(call):
+    try:
+        return call()
+    finally:
+        close_old_connections()
+
+
+# Runs functions of no arguments on the pool at the same time and returns
+# their results in order
+# with INVENTORY_ASYNC_THREADS = 0 they run one after another in the
+# request's thread, as the tests need to see their own transaction
+async def run_queries(*calls):
+    if not settings.INVENTORY_ASYNC_THREADS:
+        return [await sync_to_async(call)() for call in calls]
+    loop = asyncio.get_running_loop()
+    # in the caller's context, e.g. reporting from the replica (see routers.py)
+    return await asyncio.gather(*[
+        loop.run_in_executor(get_executor(), contextvars.copy_context().run, _run, call)
+        for call in calls
+    ])
+
+
+# Turns a sync view class into an async one: get() builds and renders the
+# response on the pool
+# the session user is loaded there first, so LoginRequiredMixin can check
+# it without touching the database from the event loop
+class AsyncViewMixin:
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            await run_queries(lambda: request.user.is_authenticated)
+            response = view(request, *args, **kwargs)
+            # a redirect to log in or a disallowed method comes back directly
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+
+        update_wrapper(async_view, view)
+        return async_view
+
+    async def get(self, request, *args, **kwargs):
+        response, = await run_queries(
+            lambda: super(AsyncViewMixin, self).get(request, *args, **kwargs).render()
+        )
+        return response
+
+
+class MenuView(AsyncViewMixin, views.MenuView):
+    pass
+
+
+class ReportView(AsyncViewMixin, views.ReportView):
+    pass
+
+
+# the two rankings are independent queries, run side by side before the
+# page is built around them
+class BestSellerView(AsyncViewMixin, views.BestSellerView):
+    async def get(self, request, *args, **kwargs):
+        rankings = super().rankings(BestSellerFilterForm(request.GET or None))
+        self.ranked = await run_queries(*[partial(list, ranking) for ranking in rankings])
+        return await super().get(request, *args, **kwargs)
+
+    def rankings(self, form):
+        return self.ranked
+
+
+class TableOrderView(AsyncViewMixin, views.TableOrderView):
+    pass
+
+
+class CurrentStockView(AsyncViewMixin, views.CurrentStockView):
+    pass
@@ -0,0 +1,156 @@
+import math
+import threading
+
+from collections import defaultdict
+from decimal import Decimal
+
+from .cache import current_version
+from .models import Ingredient, MenuItem, Recipe
+
+
+# In-process bill of materials: every recipe loaded once into a sparse
+# dish x ingredient matrix, stored row by row (CSR) as plain lists indexed
+# by position, so availability, costs, forecasts and what-if questions are
+# answered for every dish without going back to the database
+class BillOfMaterials:
+    def __init__(self, dishes, ingredients, lines):
+        # dishes: [(id, title)]
+        # ingredients: [(id, name, quantity, unit_price)]
+        # lines: [(dish id, ingredient id, quantity)]
+        self.dish_ids = [pk for pk, title in dishes]
+        self.dish_titles = [title for pk, title in dishes]
+        self.dish_index = {pk: i for i, pk in enumerate(self.dish_ids)}
+        self.ingredient_ids = [row[0] for row in ingredients]
+        self.ingredient_names = [row[1] for row in ingredients]
+        self.ingredient_index = {pk: i for i, pk in enumerate(self.ingredient_ids)}
+        self.stock = [row[2] or 0 for row in ingredients]
+        self.unit_prices = [row[3] for row in ingredients]
+
+        rows = defaultdict(list)
+        for dish, ingredient, quantity in lines:
+            rows[self.dish_index[dish]].append(
+                (self.ingredient_index[ingredient], quantity)
+            )
+        # dish i's lines are indices/quantities[indptr[i]:indptr[i + 1]]
+        self.indptr = [0]
+        self.indices = []
+        self.quantities = []
+        for i in range(len(self.dish_ids)):
+            for ingredient, quantity in rows[i]:
+                self.indices.append(ingredient)
+                self.quantities.append(quantity)
+            self.indptr.append(len(self.indices))
+
+        # the transpose: dishes using each ingredient
+        self.used_by = defaultdict(list)
+        for i in range(len(self.dish_ids)):
+            for j in self.indices[self.indptr[i]:self.indptr[i + 1]]:
+                self.used_by[j].append(i)
+
+    # three queries, whatever the size of the menu
+    @classmethod
+    def load(cls):
+        return cls(
+            MenuItem.objects.order_by('pk').values_list('pk', 'title'),
+            Ingredient.objects.order_by('pk').values_list(
+                'pk', 'name', 'quantity', 'unit_price'
+            ),
+            Recipe.objects.order_by().values_list(
+                'menu_item', 'ingredient', 'quantity'
+            ),
+        )
+
+    def _lines(self, i):
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return zip(self.indices[start:end], self.quantities[start:end])
+
+    # servings of dish i from stock, as MenuItemQuerySet.with_availability()
+    # works it out: floor(min(stock / quantity)) in floating point, zero for
+    # a dish with no recipe; lines with no quantity are ignored like the
+    # NULL a division by zero gives in SQL
+    def _servings(self, i, stock):
+        portions = [
+            float(stock[j]) / float(quantity)
+            for j, quantity in self._lines(i) if quantity
+        ]
+        return max(math.floor(min(portions)), 0) if portions else 0
+
+    def _stock_after(self, changes):
+        stock = list(self.stock)
+        for ingredient, delta in changes.items():
+            j = self.ingredient_index[ingredient]
+            stock[j] = float(stock[j]) + float(delta)
+        return stock
+
+    # dict of dish id to servings that can be made from stock
+    # changes maps ingredient ids to a change in stock to ask "what if"
+    def max_servings(self, changes=None):
+        stock = self._stock_after(changes) if changes else self.stock
+        return {
+            pk: self._servings(i, stock) for i, pk in enumerate(self.dish_ids)
+        }
+
+    # dict of dish id to cost of ingredients, as recipe_cost() works it out:
+    # None for a dish with no priced ingredients
+    def costs(self):
+        costs = {}
+        for i, pk in enumerate(self.dish_ids):
+            terms = [
+                self.unit_prices[j] * quantity
+                for j, quantity in self._lines(i)
+                if self.unit_prices[j] is not None
+            ]
+            costs[pk] = sum(terms, Decimal(0)) if terms else None
+        return costs
+
+    # dict of ingredient id to quantity needed to serve a forecast,
+    # a dict of dish id to number of servings
+    def requirements(self, forecast):
+        needed = defaultdict(Decimal)
+        for dish, servings in forecast.items():
+            for j, quantity in self._lines(self.dish_index[dish]):
+                needed[self.ingredient_ids[j]] += quantity * servings
+        return dict(needed)
+
+    # dict of ingredient id to how much more than current stock a forecast
+    # needs, for the ingredients that would run short
+    def shortfall(self, forecast):
+        short = {}
+        for ingredient, needed in self.requirements(forecast).items():
+            stock = self.stock[self.ingredient_index[ingredient]]
+            missing = needed - Decimal(str(stock))
+            if missing > 0:
+                short[ingredient] = missing
+        return short
+
+    # dish ids that can be served now but not after the stock changes,
+    # e.g. {ingredient id: -500} for "what if 500 of it is wasted"
+    # only dishes using a changed ingredient are worked out again
+    def unavailable_if(self, changes):
+        stock = self._stock_after(changes)
+        affected = {
+            i for ingredient in changes
+            for i in self.used_by[self.ingredient_index[ingredient]]
+        }
+        return sorted(
+            self.dish_ids[i] for i in affected
+            if self._servings(i, self.stock) > 0 and self._servings(i, stock) == 0
+        )
+
+
+_lock = threading.Lock()
+_engine = None
+_engine_version = None
+
+
+# The bill of materials for the current inventory version, loaded once per
+# process and again after anything bumps the version: the same signals and
+# stock changes that invalidate the inventory cache (see cache.py)
+def get_bom():
+    global _engine, _engine_version
+    version = current_version()
+    with _lock:
+        if _engine is None or _engine_version != version:
+            _engine = BillOfMaterials.load()
+            _engine_version = version
+        return _engine
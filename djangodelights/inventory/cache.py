@@ -0,0 +1,75 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+
+# Versioned cache for pages and values derived from stock and recipes
+# every entry is keyed by the current "inventory version", which is bumped
+# whenever stock, recipes, dishes, purchases or the basket change
+# (see signals.py); bumping deletes the old version's entries, so nothing
+# relies on a timeout to go stale
+CACHE_ALIAS = 'inventory'
+VERSION_KEY = 'inventory:version'
+
+MISSING = object()
+
+
+def get_cache():
+    alias = CACHE_ALIAS if CACHE_ALIAS in settings.CACHES else 'default'
+    return caches[alias]
+
+
+def current_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+# key listing every entry cached under a version
+def _keys_key(version):
+    return f'inventory:{version}:keys'
+
+
+def _bump():
+    cache = get_cache()
+    old = current_version()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, old + 1, None)
+    keys = cache.get(_keys_key(old), [])
+    cache.delete_many(keys + [_keys_key(old)])
+
+
+# invalidate everything cached so far
+# bumped again on commit so a page cached mid-transaction can't outlive it
+def bump_version():
+    _bump()
+    if connection.in_atomic_block:
+        transaction.on_commit(_bump)
+
+
+def make_key(version, name, vary_on=()):
+    vary = hashlib.md5(repr(tuple(vary_on)).encode()).hexdigest()
+    return f'inventory:{version}:{name}:{vary}'
+
+
+# Returns the value cached for name and vary_on at the current version,
+# calling func() to compute and store it on a miss
+def get_or_set(name, func, vary_on=()):
+    cache = get_cache()
+    version = current_version()
+    key = make_key(version, name, vary_on)
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        value = func()
+        cache.set(key, value, None)
+        keys = cache.get(_keys_key(version), [])
+        cache.set(_keys_key(version), keys + [key], None)
+    return value
+
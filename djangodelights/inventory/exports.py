@@ -0,0 +1,102 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Ingredient, Order, Purchase
+
+
+# rows are read from the database in chunks of this many
+CHUNK_SIZE = 2000
+
+
+# csv.writer wants a file; this one hands each line straight back
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+
+# dish price and cost are the menu item's current values
+PURCHASE_COLUMNS = [
+    ('id', 'id'),
+    ('timestamp', 'table_order__timestamp'),
+    ('table', 'table_order__table_num'),
+    ('dish', 'menu_item_name'),
+    ('quantity', 'quantity'),
+    ('price', 'menu_item__price'),
+    ('cost', 'menu_item__cost'),
+]
+
+ORDER_COLUMNS = [
+    ('id', 'id'),
+    ('order_number', 'order_number_id'),
+    ('timestamp', 'order_number__timestamp'),
+    ('ingredient', 'ingredient_name'),
+    ('quantity', 'quantity'),
+]
+
+STOCK_COLUMNS = [
+    ('id', 'id'),
+    ('ingredient', 'name'),
+    ('quantity', 'quantity'),
+    ('unit', 'unit'),
+    ('unit_price', 'unit_price'),
+    ('kanban', 'kanban'),
+    ('threshold', 'threshold'),
+    ('re_order', 're_order'),
+]
+
+# name: (function returning the rows for a period, columns)
+EXPORTS = {
+    'purchases': (
+        lambda since, until, table: Purchase.objects.for_period(since, until, table),
+        PURCHASE_COLUMNS,
+    ),
+    'orders': (
+        lambda since, until, table: Order.objects.for_period(since, until),
+        ORDER_COLUMNS,
+    ),
+    'stock': (
+        lambda since, until, table: Ingredient.objects.all(),
+        STOCK_COLUMNS,
+    ),
+}
+
+
+# Returns the header and an iterator over the rows of an export, in id
+# order and fetched in chunks, so memory stays flat however many there are
+# every export starts with the id column: pass the last id received as
+# `after` to resume an interrupted export
+def export_rows(name, since=None, until=None, table=None, after=None):
+    source, columns = EXPORTS[name]
+    queryset = source(since, until, table)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    header = [header for header, lookup in columns]
+    lookups = [lookup for header, lookup in columns]
+    rows = queryset.order_by('pk').values_list(*lookups)
+    return header, rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+# lines of an export in csv or ndjson format
+def export_lines(name, format, **kwargs):
+    lines, content_type = FORMATS[format]
+    return lines(*export_rows(name, **kwargs))
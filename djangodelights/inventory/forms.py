@@ -1,10 +1,16 @@
+import json
+
+from datetime import datetime, time, timedelta
+
 from django import forms, template
 
 from django.core.exceptions import ValidationError
 from django.forms import modelformset_factory, BaseModelFormSet
+from django.utils import timezone
 
 from .models import Basket, Ingredient, MenuItem, Recipe, Purchase, OrderNumber, Order
 from .models import TableOrder
+from .stocktake import read_csv, read_json
 
 # Add any item to basket
 class AddForm(forms.ModelForm):
@@ -12,6 +18,10 @@ class AddForm(forms.ModelForm):
         model = Basket
         fields = '__all__'
 
+    # an ingredient already in the basket is added to its line
+    def validate_unique(self):
+        pass
+
 
 # Add item from restock list to basket
 class BasketAddForm(forms.ModelForm):
@@ -26,18 +36,35 @@ class BasketAddForm(forms.ModelForm):
 
 # Add in item from restock list to basket as an update
 class BasketUpdateForm(forms.ModelForm):
+    # a change to the line rather than its new quantity, so it may be
+    # negative and isn't validated against the model
+    quantity = forms.IntegerField()
+
     class Meta:
         model = Basket
-        fields = ['quantity']
+        fields = []
 
     def __init__(self, basket_obj=None, **kwargs):
         super().__init__(**kwargs)
-        self.initial['quantity'] = basket_obj.ingredient.buy()
+        ingredients = Ingredient.objects.with_shopping()
+        ingredient = ingredients.get(pk=basket_obj.ingredient_id)
+        self.initial['quantity'] = ingredient.buy()
+
+
+# load basket ingredients with the basket lines
+class BaseEditBasketFormSet(BaseModelFormSet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queryset = Basket.objects.select_related('ingredient')
 
 
 # Edit basket
 EditBasketFormset = modelformset_factory(
-    Basket, fields=('quantity',), can_delete=True, extra=0
+    Basket,
+    fields=('quantity',),
+    formset=BaseEditBasketFormSet,
+    can_delete=True,
+    extra=0
 )
 
 
@@ -74,9 +101,18 @@ class IngredientEditForm(forms.ModelForm):
 #         self.fields['display'].widget.attrs.update({'onchange': 'submit();'})
 
 
+# annotate availability so the template doesn't query once per dish
+class BaseMenuFormSet(BaseModelFormSet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        menu = MenuItem.objects.select_related('category')
+        self.queryset = menu.with_availability()
+
+
 UpdateMenuFormSet = modelformset_factory(
     MenuItem,
     fields=('title', 'price', 'stock_item','display',),
+    formset=BaseMenuFormSet,
     extra=0,
     # widgets={'display': forms.CheckboxInput(attrs={'onchange': 'submit();'})}
 )
@@ -97,6 +133,44 @@ UpdateStockFormset = modelformset_factory(
 )
 
 
+# upload a stock take CSV
+# rows carries the counted rows from the preview to the apply step
+class StockTakeForm(forms.Form):
+    file = forms.FileField(required=False, label='Stock take CSV')
+    rows = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    # puts the counted (name, quantity) rows in cleaned_data['counted']
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('file'):
+            cleaned_data['counted'] = read_csv(cleaned_data['file'])
+        elif cleaned_data.get('rows'):
+            try:
+                rows = json.loads(cleaned_data['rows'])
+            except ValueError:
+                raise ValidationError('Stock take rows are not valid JSON')
+            cleaned_data['counted'] = read_json(rows)
+        else:
+            raise ValidationError('Choose a CSV file to upload')
+        return cleaned_data
+
+
+# record stock thrown away
+class WasteForm(forms.Form):
+    ingredient = forms.ModelChoiceField(
+        queryset=Ingredient.objects.filter(quantity__gt=0)
+    )
+    quantity = forms.IntegerField(min_value=1)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        ingredient = cleaned_data.get('ingredient')
+        quantity = cleaned_data.get('quantity')
+        if ingredient and quantity and quantity > ingredient.quantity:
+            raise ValidationError('Cannot waste more than is in stock')
+        return cleaned_data
+
+
 # used to add menu item
 class MenuAddForm(forms.ModelForm):
     class Meta:
@@ -108,7 +182,8 @@ class MenuAddForm(forms.ModelForm):
 class BaseMenuDetailsFormSet(BaseModelFormSet):
     def __init__(self, menu_item=None, **kwargs):
         super().__init__(**kwargs)
-        self.queryset = Recipe.objects.filter(menu_item=menu_item)
+        recipe = Recipe.objects.filter(menu_item=menu_item)
+        self.queryset = recipe.select_related('ingredient')
 
 
 # update recipe item quantities or delete
@@ -137,19 +212,17 @@ class PurchaseAddForm(forms.ModelForm):
         model = Purchase
         fields = ['menu_item', 'quantity']
 
-    # only list dishes available to purchase
+    # only list dishes available to purchase, in a single query
     def __init__(self, table_order=None, **kwargs):
         # exclude objects already on the order
-        purchase = Purchase.objects.filter(table_order__id=table_order)
-        excl_list = [item.menu_item.id for item in purchase]
-        menu = MenuItem.objects.exclude(id__in=excl_list)
+        menu = MenuItem.objects.exclude(purchase__table_order=table_order)
         # list items in stock
-        filter_list = [item.id for item in menu if item.available() > 0]
-        in_stock = MenuItem.objects.filter(id__in=filter_list)
+        in_stock = menu.with_availability().filter(availability__gt=0)
         super().__init__(**kwargs)
         self.fields['menu_item'].queryset = in_stock
 
     # cleaned quantity must not be > available
+    # menu_item comes from the annotated queryset so this is not a query
     def clean_quantity(self):
         data = self.cleaned_data['quantity']
         menu_item = self.cleaned_data['menu_item']
@@ -168,10 +241,11 @@ class PurchaseEditForm(forms.ModelForm):
         fields = ["quantity"]
 
     # cleaned quantity must not be > available
+    # worked out for this dish alone in one query
     def clean_quantity(self):
         data = self.cleaned_data['quantity']
-        menu_item = self.instance.menu_item
-        available = menu_item.available()
+        menu = MenuItem.objects.filter(pk=self.instance.menu_item_id).with_availability()
+        available = menu.values_list('availability', flat=True).first() or 0
         orig_qty = self.instance.quantity
         delta = data - orig_qty
         if delta > available:
@@ -203,3 +277,78 @@ class TableOrderAddForm(forms.ModelForm):
     class Meta:
         model = TableOrder
         fields = ['timestamp', 'table']
+
+
+############################
+# Sales and profit reports #
+############################
+# filter sales reports by date range and table
+# a window of 'today' or 'week' takes precedence over start and end
+class DateFilterForm(forms.Form):
+    WINDOW_CHOICES = [
+        ('', 'Date range'),
+        ('today', 'Today'),
+        ('week', 'Last 7 days'),
+    ]
+
+    window = forms.ChoiceField(choices=WINDOW_CHOICES, required=False)
+    start = forms.DateField(
+        required=False, widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    end = forms.DateField(
+        required=False, widget=forms.DateInput(attrs={'type': 'date'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        if start and end and start > end:
+            raise ValidationError('Start date must be before end date')
+        return cleaned_data
+
+    # keyword arguments for the for_period() queryset methods
+    # end date is inclusive so the range runs to midnight after it
+    def period(self):
+        data = self.cleaned_data if self.is_valid() else {}
+        since = until = None
+        if data.get('window') == 'today':
+            today = timezone.localdate()
+            since = timezone.make_aware(datetime.combine(today, time.min))
+        elif data.get('window') == 'week':
+            since = timezone.now() - timedelta(days=7)
+        elif data.get('start'):
+            since = timezone.make_aware(datetime.combine(data['start'], time.min))
+        if data.get('end') and not data.get('window'):
+            end = data['end'] + timedelta(days=1)
+            until = timezone.make_aware(datetime.combine(end, time.min))
+        return {'since': since, 'until': until}
+
+
+# date range and table filter for sales and customer orders
+class SalesFilterForm(DateFilterForm):
+    table = forms.IntegerField(required=False, min_value=0)
+
+    def period(self):
+        data = self.cleaned_data if self.is_valid() else {}
+        return {**super().period(), 'table': data.get('table')}
+
+
+# best sellers also choose how many dishes to rank
+class BestSellerFilterForm(SalesFilterForm):
+    top = forms.IntegerField(required=False, min_value=1, max_value=100)
+
+    # number of dishes to list, defaults to 10
+    def limit(self):
+        data = self.cleaned_data if self.is_valid() else {}
+        return data.get('top') or 10
+
+
+# exports resume after the last id received
+class ExportFilterForm(SalesFilterForm):
+    after = forms.IntegerField(required=False, min_value=0)
+
+    # keyword arguments for exports.export_rows()
+    def options(self):
+        data = self.cleaned_data if self.is_valid() else {}
+        return {**self.period(), 'after': data.get('after')}
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import threading
+
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+
+from .bom import get_bom
+
+
+# Live stock and availability feed for front-of-house screens, as
+# Server-Sent Events from the ASGI application (see djangodelights/asgi.py)
+# each committed stock change works out which dishes and ingredients
+# changed once, from the bill of materials, and fans the result out to every
+# connected client through an in-process broadcaster, so screens update
+# without polling the database
+# the broadcaster lives in one process: stock changes made by another
+# process (e.g. a separate WSGI server) reach the feed's clients only when
+# that process changes stock again
+STREAM_PATH = '/stock/live/'
+
+# seconds between comments that keep an idle connection open
+KEEPALIVE = 15
+
+# events a client can fall behind by before it is sent a fresh snapshot
+QUEUE_SIZE = 100
+
+# queued in place of events a slow client missed
+RESYNC = object()
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC)
+
+
+# Fans events out to subscribers, each an asyncio queue on the event loop
+# that subscribed; publish() can be called from any thread
+class Broadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            loop, queue = subscriber
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # its event loop has closed
+                self.unsubscribe(subscriber)
+
+
+broadcaster = Broadcaster()
+
+_lock = threading.Lock()
+_published = None
+
+
+def _state():
+    bom = get_bom()
+    servings = bom.max_servings()
+    dishes = {
+        pk: {'title': title, 'available': servings[pk]}
+        for pk, title in zip(bom.dish_ids, bom.dish_titles)
+    }
+    stock = {
+        pk: {'name': name, 'quantity': quantity}
+        for pk, name, quantity
+        in zip(bom.ingredient_ids, bom.ingredient_names, bom.stock)
+    }
+    return dishes, stock
+
+
+# with no one connected what was last published goes out of date
+def _forget():
+    global _published
+    with _lock:
+        _published = None
+
+
+# every dish and ingredient, sent to a client when it connects
+# it starts the record of what was published if there isn't one: replacing
+# it could hide a change from the clients already connected
+def availability_snapshot():
+    global _published
+    dishes, stock = _state()
+    with _lock:
+        if _published is None:
+            _published = dishes, stock
+    return {'dishes': dishes, 'stock': stock}
+
+
+# Publishes the dishes and ingredients that changed since the last event,
+# worked out once however many clients are connected
+# with no one connected there is nothing to work out
+def publish_availability():
+    global _published
+    if not broadcaster:
+        _forget()
+        return
+    dishes, stock = _state()
+    with _lock:
+        previous, _published = _published, (dishes, stock)
+    if previous is not None:
+        dishes = {pk: dish for pk, dish in dishes.items() if previous[0].get(pk) != dish}
+        stock = {pk: item for pk, item in stock.items() if previous[1].get(pk) != item}
+    if dishes or stock:
+        broadcaster.publish({'dishes': dishes, 'stock': stock})
+
+
+def encode_event(data, event='availability'):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+# the session's user, as AuthenticationMiddleware would find it
+def _user(scope):
+    cookie = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookie.load(value.decode('latin-1'))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(morsel.value if morsel else None)
+    return get_user(SimpleNamespace(session=session))
+
+
+async def _disconnected(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+# ASGI application serving the feed at STREAM_PATH to logged in users:
+# a snapshot on connecting, then an event for each change
+async def availability_stream(scope, receive, send):
+    user = await sync_to_async(_user)(scope)
+    if not user.is_authenticated:
+        await send({
+            'type': 'http.response.start',
+            'status': 403,
+            'headers': [(b'content-type', b'text/plain')],
+        })
+        await send({'type': 'http.response.body', 'body': b'Forbidden'})
+        return
+
+    subscriber = broadcaster.subscribe()
+    loop, queue = subscriber
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    event = None
+    try:
+        snapshot = await sync_to_async(availability_snapshot)()
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': encode_event(snapshot),
+            'more_body': True,
+        })
+        event = asyncio.ensure_future(queue.get())
+        while True:
+            done, pending = await asyncio.wait(
+                {event, disconnect},
+                timeout=KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnect in done:
+                break
+            if event in done:
+                data = event.result()
+                if data is RESYNC:
+                    data = await sync_to_async(availability_snapshot)()
+                body = encode_event(data)
+                event = asyncio.ensure_future(queue.get())
+            else:
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        if not broadcaster:
+            _forget()
+        disconnect.cancel()
+        if event is not None:
+            event.cancel()
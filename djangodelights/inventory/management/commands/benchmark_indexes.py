@@ -0,0 +1,107 @@
+import time
+
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from inventory.models import Basket, Ingredient, Purchase, TableOrder
+from inventory.synthetic import generate
+
+
+# Show EXPLAIN plans and timings of the hot queries with and without the
+# indexes declared on the inventory models, on a large generated dataset
+# runs in a throwaway test database so the real data is never touched
+class Command(BaseCommand):
+    help = 'Compare query plans and timings with and without model indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--dishes', type=int, default=500)
+        parser.add_argument('--table-orders', type=int, default=20000)
+        parser.add_argument('--purchases', type=int, default=100000)
+        parser.add_argument(
+            '--repeat', type=int, default=5, help='Runs per query, best is kept'
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            self.stdout.write('Generating data...')
+            generate(
+                ingredients=options['ingredients'],
+                dishes=options['dishes'],
+                recipe_lines=5,
+                table_orders=options['table_orders'],
+                purchases=options['purchases'],
+                basket=options['ingredients'] // 10,
+                orders=50,
+            )
+            queries = self.queries()
+            after = self.measure(queries, options['repeat'])
+            self.drop_indexes()
+            before = self.measure(queries, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for label in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(
+                f"  without indexes {before[label]['ms']:.3f} ms, "
+                f"with indexes {after[label]['ms']:.3f} ms"
+            )
+            self.stdout.write('  plan without indexes:')
+            self.stdout.write(self.indent(before[label]['plan']))
+            self.stdout.write('  plan with indexes:')
+            self.stdout.write(self.indent(after[label]['plan']))
+
+    # representative queries from views.py and forms.py
+    def queries(self):
+        week_ago = timezone.now() - timedelta(days=7)
+        table_order = TableOrder.objects.order_by('pk').first()
+        ingredient = Basket.objects.first().ingredient
+        return {
+            'customer orders': TableOrder.objects.all()[:50],
+            'table orders this week at a table': TableOrder.objects.filter(
+                table_num=3, timestamp__gte=week_ago
+            ),
+            'purchases this week': Purchase.objects.for_period(since=week_ago),
+            'best sellers': Purchase.objects.best_sellers(),
+            'purchases on a table order': Purchase.objects.filter(
+                table_order=table_order
+            ),
+            'current stock': Ingredient.objects.filter(quantity__gt=0),
+            'shopping list': Ingredient.objects.shopping_list(),
+            'basket line for an ingredient': Basket.objects.filter(
+                ingredient=ingredient
+            ),
+        }
+
+    def measure(self, queries, repeat):
+        results = {}
+        for label, queryset in queries.items():
+            timings = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - start)
+            results[label] = {
+                'ms': min(timings) * 1000,
+                'plan': queryset.explain(),
+            }
+        return results
+
+    def drop_indexes(self):
+        with connection.schema_editor() as schema_editor:
+            for model in apps.get_app_config('inventory').get_models():
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
+        connection.close()
+
+    def indent(self, text):
+        return '\n'.join(f'    {line}' for line in text.splitlines())
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.exports import EXPORTS, FORMATS, export_lines
+from inventory.forms import ExportFilterForm
+from inventory.routers import reporting
+
+
+# stream an export to a file or stdout, see inventory/exports.py
+class Command(BaseCommand):
+    help = 'Export purchases, shopping orders or stock as csv or ndjson'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--start', help='First day, YYYY-MM-DD')
+        parser.add_argument('--end', help='Last day, YYYY-MM-DD')
+        parser.add_argument('--table', type=int)
+        parser.add_argument(
+            '--after', type=int, help='Resume after this id'
+        )
+        parser.add_argument('--output', help='File to write, default stdout')
+
+    def handle(self, *args, **options):
+        data = {
+            key: options[key] for key in ('start', 'end', 'table', 'after')
+            if options[key] is not None
+        }
+        form = ExportFilterForm(data)
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        lines = export_lines(options['name'], options['format'], **form.options())
+
+        # read from the replica, if there is one
+        with reporting():
+            if options['output']:
+                with open(options['output'], 'w', newline='') as f:
+                    f.writelines(lines)
+            else:
+                for line in lines:
+                    self.stdout.write(line, ending='')
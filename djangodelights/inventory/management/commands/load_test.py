@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from inventory.async_urls import ASYNC_VIEWS
+from inventory.synthetic import generate
+
+
+HOST = 'localhost'
+
+
+def wsgi_request(handler, path, cookie):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'HTTP_HOST': HOST,
+        'HTTP_COOKIE': cookie,
+    }
+    setup_testing_defaults(environ)
+    status = []
+    start = time.perf_counter()
+    body = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        b''.join(body)
+    finally:
+        body.close()
+    return int(status[0].split()[0]), time.perf_counter() - start
+
+
+async def asgi_request(handler, path, cookie):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', HOST.encode()), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    start = time.perf_counter()
+    await handler(scope, receive, send)
+    return messages[0]['status'], time.perf_counter() - start
+
+
+# a threaded WSGI server: each of `concurrency` threads serves one
+# request at a time
+def run_wsgi(paths, concurrency, cookie):
+    handler = WSGIHandler()
+    with ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda path: wsgi_request(handler, path, cookie), paths))
+    return results, time.perf_counter() - start
+
+
+# an ASGI server with `concurrency` connections open at a time
+def run_asgi(paths, concurrency, cookie):
+    handler = ASGIHandler()
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request(path):
+            async with semaphore:
+                return await asgi_request(handler, path, cookie)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[request(path) for path in paths])
+        return results, time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+# name: (server, urlconf)
+# asgi-sync is the ASGI server with the sync views, which all share a thread
+MODES = {
+    'wsgi': (run_wsgi, 'djangodelights.urls'),
+    'asgi-sync': (run_asgi, 'djangodelights.urls'),
+    'asgi': (run_asgi, 'djangodelights.asgi_urls'),
+}
+
+
+# Throughput and latency of the read-heavy pages served in-process through
+# WSGI and ASGI handlers, on the same generated dataset
+# runs in a throwaway test database so the real data is never touched
+class Command(BaseCommand):
+    help = 'Compare WSGI and ASGI throughput of the read-heavy pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'pages', nargs='*', default=list(ASYNC_VIEWS),
+            help='URL names to request, in turn',
+        )
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument(
+            '--concurrency', type=int, default=16,
+            help='Server threads (WSGI) or open connections (ASGI)',
+        )
+        parser.add_argument(
+            '--modes', nargs='+', choices=list(MODES), default=list(MODES)
+        )
+        parser.add_argument('--dishes', type=int, default=200)
+        parser.add_argument('--table-orders', type=int, default=5000)
+        parser.add_argument('--purchases', type=int, default=25000)
+        parser.add_argument('--json', help='Save the results to this file')
+
+    def handle(self, *args, **options):
+        test_settings = connection.settings_dict['TEST']
+        old_name = connection.settings_dict['NAME']
+        old_test_name = test_settings['NAME']
+        with tempfile.TemporaryDirectory() as directory:
+            # threads can't share an in-memory SQLite database
+            if connection.vendor == 'sqlite':
+                test_settings['NAME'] = os.path.join(directory, 'load_test.sqlite3')
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                self.stdout.write('Generating data...')
+                generate(
+                    ingredients=options['dishes'] * 4,
+                    dishes=options['dishes'],
+                    recipe_lines=5,
+                    table_orders=options['table_orders'],
+                    purchases=options['purchases'],
+                )
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings['NAME'] = old_test_name
+
+        self.stdout.write(
+            f"{options['requests']} requests, concurrency {options['concurrency']}"
+        )
+        self.stdout.write(
+            f"{'mode':<10} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}"
+        )
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<10} {result['errors']:>6} {result['rps']:>8.1f} "
+                f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f}"
+            )
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def run(self, options):
+        user = get_user_model().objects.create_user('load_test', is_staff=True)
+        client = Client()
+        client.force_login(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}='
+        cookie += client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        pages = [reverse(name) for name in options['pages']]
+        paths = [pages[i % len(pages)] for i in range(options['requests'])]
+        results = {}
+        for mode in options['modes']:
+            server, urlconf = MODES[mode]
+            with override_settings(ROOT_URLCONF=urlconf, ALLOWED_HOSTS=[HOST]):
+                # warm up caches and connections first
+                server(pages, 1, cookie)
+                responses, elapsed = server(paths, options['concurrency'], cookie)
+            latencies = sorted(duration * 1000 for status, duration in responses)
+            results[mode] = {
+                'errors': sum(status != 200 for status, duration in responses),
+                'rps': len(responses) / elapsed,
+                'p50_ms': statistics.median(latencies),
+                'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+            }
+        return results
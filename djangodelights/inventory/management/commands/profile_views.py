@@ -0,0 +1,64 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from inventory.profiler import stats
+
+
+# pages profiled when no paths are given: every url without arguments
+DEFAULT_VIEWS = [
+    'home', 'menu', 'menu_edit', 'table_order', 'report', 'best_sellers',
+    'current_stock', 'update_stock', 'stocked_recipes', 'shopping_list',
+    'basket_view', 'edit_basket', 'ingredients', 'orphans', 'orders',
+]
+
+
+# request pages in-process against the current database, through the
+# query profiler middleware, and print its hot-path report
+class Command(BaseCommand):
+    help = 'Profile queries, duplicate SQL and timings of inventory pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='URL paths to profile')
+        parser.add_argument(
+            '--user', required=True, help='Username to log in as'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=1, help='Requests per page'
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['user']}")
+
+        client = Client()
+        client.force_login(user)
+        paths = options['paths'] or [reverse(name) for name in DEFAULT_VIEWS]
+
+        stats.reset()
+        # the middleware is loaded on the client's first request
+        with override_settings(INVENTORY_PROFILER=True, ALLOWED_HOSTS=['testserver']):
+            try:
+                for path in paths:
+                    for i in range(options['repeat']):
+                        response = client.get(path)
+                        if response.status_code >= 400:
+                            raise CommandError(
+                                f'{path} returned {response.status_code}'
+                            )
+            finally:
+                client.logout()
+
+        for row in stats.report():
+            self.stdout.write(
+                f"{row['view']}: {row['avg_queries']} queries, "
+                f"{row['avg_db_ms']} ms in database, "
+                f"{row['avg_render_ms']} ms rendering, "
+                f"{row['avg_total_ms']} ms in total"
+            )
+            for sql, count in row['duplicates']:
+                self.stdout.write(f'    {count}x {sql[:120]}')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.cache import bump_version
+from inventory.models import MenuItem
+
+
+# rebuild the cached menu_item cost column or check it for drift
+class Command(BaseCommand):
+    help = 'Rebuild cached dish costs from recipes, or check them for drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Report dishes whose cached cost is stale without fixing them',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = self.find_drift()
+            for title, cached, actual in drift:
+                self.stdout.write(f'{title}: cached {cached}, actual {actual}')
+            if drift:
+                raise CommandError(f'{len(drift)} dish cost(s) out of date')
+            self.stdout.write(self.style.SUCCESS('Dish costs are up to date'))
+        else:
+            updated = MenuItem.objects.update_costs()
+            bump_version()
+            self.stdout.write(
+                self.style.SUCCESS(f'Rebuilt cost of {updated} dish(es)')
+            )
+
+    # list of (title, cached cost, actual cost) for stale dishes
+    def find_drift(self):
+        menu = MenuItem.objects.with_recipe_cost()
+        rows = menu.values_list('title', 'cost', 'recipe_cost')
+        return [row for row in rows if row[1] != row[2]]
@@ -0,0 +1,76 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils import timezone
+
+from inventory.bom import get_bom
+from inventory.models import Ingredient, Purchase
+
+
+# what a forecast of covers needs from stock, or which dishes a drop in
+# stock would take off the menu, answered from the bill of materials
+class Command(BaseCommand):
+    help = 'Forecast ingredient needs for a number of covers, or ask what if stock drops'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--covers', type=int,
+            help='Dishes to forecast, split by the recent sales mix',
+        )
+        parser.add_argument(
+            '--days', type=int, default=28,
+            help='Days of sales to take the mix from',
+        )
+        parser.add_argument(
+            '--drop', nargs=2, action='append', metavar=('INGREDIENT', 'QUANTITY'),
+            help='What if stock of an ingredient drops by a quantity',
+        )
+
+    def handle(self, *args, **options):
+        if not options['covers'] and not options['drop']:
+            raise CommandError('Give --covers and/or --drop')
+        bom = get_bom()
+        if options['covers']:
+            self.forecast(bom, options['covers'], options['days'])
+        if options['drop']:
+            self.what_if(bom, options['drop'])
+
+    def forecast(self, bom, covers, days):
+        since = timezone.now() - timedelta(days=days)
+        sales = Purchase.objects.for_period(since=since).filter(
+            menu_item__isnull=False
+        ).order_by().values('menu_item').annotate(total=Sum('quantity'))
+        mix = {row['menu_item']: row['total'] for row in sales}
+        sold = sum(mix.values())
+        if not sold:
+            raise CommandError(f'No sales in the last {days} days')
+        forecast = {
+            dish: Decimal(covers * total) / sold for dish, total in mix.items()
+        }
+
+        short = bom.shortfall(forecast)
+        needed = bom.requirements(forecast)
+        self.stdout.write(f'Ingredients needed for {covers} covers:')
+        for ingredient, quantity in sorted(needed.items()):
+            name = bom.ingredient_names[bom.ingredient_index[ingredient]]
+            line = f'  {name}: {quantity:.1f}'
+            if ingredient in short:
+                line += f' (short by {short[ingredient]:.1f})'
+            self.stdout.write(line)
+
+    def what_if(self, bom, drops):
+        names = [name for name, quantity in drops]
+        ids = dict(Ingredient.objects.filter(name__in=names).values_list('name', 'pk'))
+        changes = {}
+        for name, quantity in drops:
+            if name not in ids:
+                raise CommandError(f'No ingredient called {name}')
+            changes[ids[name]] = -float(quantity)
+        lost = bom.unavailable_if(changes)
+        if not lost:
+            self.stdout.write('No dishes would become unavailable')
+        for dish in lost:
+            title = bom.dish_titles[bom.dish_index[dish]]
+            self.stdout.write(f'{title} would become unavailable')
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.cache import bump_version
+from inventory.models import Ingredient, StockSnapshot
+
+
+# snapshot the stock ledger (run periodically, e.g. nightly from cron),
+# check Ingredient.quantity against it, or set it from the ledger
+class Command(BaseCommand):
+    help = 'Snapshot the stock ledger, or check or refresh stock from it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Report ingredients whose stock differs from the ledger',
+        )
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help='Set every ingredient\'s stock from the ledger',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = self.find_drift()
+            for name, quantity, ledger in drift:
+                self.stdout.write(f'{name}: stock {quantity}, ledger {ledger}')
+            if drift:
+                raise CommandError(f'{len(drift)} ingredient(s) differ from the ledger')
+            self.stdout.write(self.style.SUCCESS('Stock matches the ledger'))
+        elif options['refresh']:
+            # e.g. after a refresh on commit was lost with INVENTORY_APPEND_STOCK
+            refreshed = Ingredient.objects.refresh_stock()
+            bump_version()
+            self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} ingredient(s)'))
+        else:
+            taken = StockSnapshot.objects.take()
+            self.stdout.write(self.style.SUCCESS(f'Took {taken} snapshot(s)'))
+
+    # list of (name, stock, ledger stock) for ingredients that differ
+    def find_drift(self):
+        ingredients = Ingredient.objects.with_stock_at()
+        rows = ingredients.values_list('name', 'quantity', 'ledger_quantity')
+        return [row for row in rows if Decimal(str(row[1] or 0)) != row[2]]
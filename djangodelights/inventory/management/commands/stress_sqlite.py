@@ -0,0 +1,131 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections, connection
+from django.test import override_settings
+
+from inventory.models import Basket, Ingredient, MenuItem, OrderNumber, StockMovement
+from inventory.synthetic import generate
+
+
+# Concurrent service-time writes against each SQLite database profile:
+# threads selling dishes (adjust_stock) and taking deliveries
+# (OrderNumber.save), ending every operation as a request would, so
+# connections are reused or reopened as the profile says
+# --append runs them with INVENTORY_APPEND_STOCK, appending to the ledger
+# runs in throwaway database files so the real data is never touched
+class Command(BaseCommand):
+    help = 'Compare lock errors and write throughput of SQLite profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--operations', type=int, default=200, help='Writes per thread'
+        )
+        parser.add_argument(
+            '--deliveries', type=float, default=0.1,
+            help='Share of writes that are deliveries rather than sales',
+        )
+        parser.add_argument(
+            '--profiles', nargs='+', choices=list(settings.SQLITE_PROFILES),
+            default=list(settings.SQLITE_PROFILES),
+        )
+        parser.add_argument(
+            '--append', action='store_true',
+            help='Append stock movements, refreshing stock after each commit',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite')
+        results = {}
+        for name in options['profiles']:
+            results[name] = self.stress(settings.SQLITE_PROFILES[name], options)
+
+        self.stdout.write(
+            f"{options['threads']} threads x {options['operations']} writes"
+        )
+        self.stdout.write(
+            f"{'profile':<12} {'ok':>6} {'errors':>6} {'seconds':>8} {'writes/s':>9}"
+        )
+        for name, (ok, errors, elapsed) in results.items():
+            self.stdout.write(
+                f'{name:<12} {ok:>6} {errors:>6} {elapsed:>8.2f} {ok / elapsed:>9.1f}'
+            )
+
+    def stress(self, profile, options):
+        test_settings = connection.settings_dict['TEST']
+        old_name = connection.settings_dict['NAME']
+        old_test_name = test_settings['NAME']
+        old_max_age = connection.settings_dict['CONN_MAX_AGE']
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(INVENTORY_SQLITE=profile,
+                                  INVENTORY_APPEND_STOCK=options['append']):
+            test_settings['NAME'] = os.path.join(directory, 'stress.sqlite3')
+            connection.settings_dict['CONN_MAX_AGE'] = profile['CONN_MAX_AGE']
+            connection.close()
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                generate(ingredients=40, dishes=20, recipe_lines=3, table_orders=0,
+                         purchases=0, basket=0, orders=0)
+                # plenty of stock, so a sale only fails on a locked database
+                StockMovement.objects.record(StockMovement.STOCK_TAKE, [
+                    (pk, 10 ** 9 - quantity)
+                    for pk, quantity in Ingredient.objects.values_list('pk', 'quantity')
+                ])
+                Ingredient.objects.update(quantity=10 ** 9)
+                connection.close()
+                return self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings['NAME'] = old_test_name
+                connection.settings_dict['CONN_MAX_AGE'] = old_max_age
+
+    def run(self, options):
+        dishes = list(MenuItem.objects.all())
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        connection.close()
+        counts = {'ok': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            ok = errors = 0
+            for i in range(options['operations']):
+                try:
+                    if rng.random() < options['deliveries']:
+                        Basket.objects.add(rng.choice(ingredients), 10)
+                        OrderNumber().save()
+                        done = True
+                    else:
+                        done = rng.choice(dishes).adjust_stock(-1)
+                except DatabaseError:
+                    done = False
+                if done:
+                    ok += 1
+                else:
+                    errors += 1
+                # the end of a request
+                close_old_connections()
+            connection.close()
+            with lock:
+                counts['ok'] += ok
+                counts['errors'] += errors
+
+        threads = [
+            threading.Thread(target=worker, args=(seed,))
+            for seed in range(options['threads'])
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts['ok'], counts['errors'], time.perf_counter() - start
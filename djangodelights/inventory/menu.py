@@ -0,0 +1,37 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from .models import MenuItem
+
+
+# plain values the menu page shows, so rendering touches no models
+MenuRow = namedtuple('MenuRow', ['pk', 'title', 'price', 'profit', 'available'])
+MenuSection = namedtuple('MenuSection', ['category', 'rows'])
+
+
+# as MenuItem.dish_profit(), from the cached cost
+def _profit(price, cost):
+    if cost is None:
+        return 0
+    return (price - cost).quantize(Decimal('0.01'))
+
+
+# Displayed dishes grouped into sections by category, from one query:
+# category, cached cost and availability come with each dish and the
+# database sorts by category then title
+def menu_sections():
+    menu = MenuItem.objects.filter(display=True).with_availability()
+    rows = menu.order_by('category_id', 'title').values_list(
+        'category_id', 'category__category', 'pk', 'title', 'price', 'cost',
+        'availability',
+    )
+    sections = []
+    last = None
+    for category_id, category, pk, title, price, cost, available in rows:
+        if category_id != last:
+            sections.append(MenuSection(category, []))
+            last = category_id
+        sections[-1].rows.append(
+            MenuRow(pk, title, price, _profit(price, cost), int(available))
+        )
+    return sections
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.9 on 2026-10-18 17:48
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+
+
+# fill the new cost column from existing recipes
+def populate_cost(apps, schema_editor):
+    MenuItem = apps.get_model('inventory', 'MenuItem')
+    Recipe = apps.get_model('inventory', 'Recipe')
+    recipe = Recipe.objects.filter(menu_item=OuterRef('pk')).order_by()
+    total = Sum(F('ingredient__unit_price') * F('quantity'))
+    recipe = recipe.values('menu_item').annotate(total=total)
+    output_field = models.DecimalField(max_digits=16, decimal_places=6)
+    cost = Subquery(recipe.values('total'), output_field=output_field)
+    MenuItem.objects.update(cost=cost)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0043_auto_20220428_1310'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='cost',
+            field=models.DecimalField(blank=True, decimal_places=6, editable=False, max_digits=16, null=True),
+        ),
+        migrations.RunPython(populate_cost, migrations.RunPython.noop),
+    ]
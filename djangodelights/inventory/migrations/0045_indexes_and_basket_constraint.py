@@ -0,0 +1,58 @@
+# Generated by Django 3.2.9 on 2026-10-18 17:57
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+# fold duplicate basket lines into one per ingredient before making it unique
+def merge_basket_lines(apps, schema_editor):
+    Basket = apps.get_model('inventory', 'Basket')
+    duplicates = (
+        Basket.objects.values('ingredient')
+        .annotate(lines=Count('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates:
+        lines = Basket.objects.filter(ingredient=row['ingredient']).order_by('id')
+        keep = lines.first()
+        lines.exclude(id=keep.id).delete()
+        Basket.objects.filter(id=keep.id).update(quantity=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0044_menuitem_cost'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['name'], name='ingredient_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(('kanban', True)), fields=['quantity', 'threshold'], name='ingredient_kanban_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['table_order', 'menu_item_name'], name='purchase_order_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['menu_item_name', 'quantity'], name='purchase_name_quantity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tableorder',
+            index=models.Index(fields=['-timestamp'], name='tableorder_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tableorder',
+            index=models.Index(fields=['table_num', 'timestamp'], name='tableorder_table_time_idx'),
+        ),
+        migrations.RunPython(merge_basket_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basket',
+            constraint=models.UniqueConstraint(fields=('ingredient',), name='unique_basket_ingredient'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# existing stock becomes each ingredient's opening snapshot
+def open_ledger(apps, schema_editor):
+    Ingredient = apps.get_model('inventory', 'Ingredient')
+    StockSnapshot = apps.get_model('inventory', 'StockSnapshot')
+    now = django.utils.timezone.now()
+    StockSnapshot.objects.bulk_create([
+        StockSnapshot(ingredient_id=pk, quantity=quantity or 0, timestamp=now)
+        for pk, quantity in Ingredient.objects.values_list('pk', 'quantity')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0046_stocktake_stockadjustment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=16)),
+                ('last_movement', models.PositiveBigIntegerField(default=0)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.ingredient')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('purchase', 'Purchase'), ('delivery', 'Delivery'), ('stock_take', 'Stock take'), ('waste', 'Waste')], max_length=20)),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=16)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.ingredient')),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stocksnapshot',
+            index=models.Index(fields=['ingredient', 'last_movement'], name='snapshot_ingredient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['ingredient', 'timestamp'], name='movement_ingredient_time_idx'),
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
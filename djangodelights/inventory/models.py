@@ -1,14 +1,39 @@
 import math
 
+from datetime import timedelta
 from decimal import Decimal
 
+from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import F, Sum
-from django.shortcuts import get_object_or_404
+from django.db import DatabaseError, IntegrityError, connections, models, router
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Max, Min
+from django.db.models import OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Cast, Coalesce, Floor
+from django.dispatch import Signal
 from django.utils import timezone
 from django.urls import reverse
 
+from .cache import bump_version
+
+
+# sent once a change to stock is committed (see live.py)
+stock_changed = Signal()
+
+
+def stock_changed_on_commit():
+    transaction.on_commit(lambda: stock_changed.send(sender=Ingredient))
+
+
+# With INVENTORY_APPEND_STOCK, sales, deliveries and waste append to the
+# stock ledger in their transaction and the quantities are refreshed from
+# it once that commits. Deliveries and waste then take no ingredient row
+# locks, but a sale still locks its ingredients to check the stock, so
+# sales sharing an ingredient still queue
+def refresh_stock_on_commit(ingredient_ids):
+    ingredients = Ingredient.objects.filter(pk__in=list(ingredient_ids))
+    transaction.on_commit(ingredients.refresh_stock)
+
 
 class Category(models.Model):
     category = models.CharField(unique=True, max_length=200)
@@ -28,9 +53,108 @@ class Table(models.Model):
         return f'Table: {self.table_num}'
 
 
+# Stock of each ingredient from the movement ledger: its latest snapshot
+# plus the movements after it, at `when` (now if None) and/or counting
+# movements up to id `last_movement`
+# used as an annotation on ingredients, see StockMovement
+def ledger_stock(when=None, last_movement=None):
+    def snapshots(ingredient):
+        snapshots = StockSnapshot.objects.filter(ingredient=ingredient)
+        if when is not None:
+            snapshots = snapshots.filter(timestamp__lte=when)
+        if last_movement is not None:
+            snapshots = snapshots.filter(last_movement__lte=last_movement)
+        return snapshots.order_by('-last_movement', '-pk')
+
+    since = snapshots(OuterRef(OuterRef('pk'))).values('last_movement')[:1]
+    movements = StockMovement.objects.filter(
+        ingredient=OuterRef('pk'), pk__gt=Coalesce(Subquery(since), 0)
+    )
+    if when is not None:
+        movements = movements.filter(timestamp__lte=when)
+    if last_movement is not None:
+        movements = movements.filter(pk__lte=last_movement)
+    tail = movements.order_by().values('ingredient').annotate(
+        total=Sum('quantity')
+    ).values('total')
+    base = snapshots(OuterRef('pk')).values('quantity')[:1]
+    return (
+        Coalesce(Subquery(base, output_field=LEDGER_FIELD), Decimal(0))
+        + Coalesce(Subquery(tail, output_field=LEDGER_FIELD), Decimal(0))
+    )
+
+
+class IngredientQuerySet(models.QuerySet):
+    # annotate basket quantity, shortfall below threshold and amount to buy
+    # basket is joined with a subquery so the list is a single query
+    def with_shopping(self):
+        basket = Basket.objects.filter(ingredient=OuterRef('pk')).order_by()
+        basket = basket.values('ingredient').annotate(total=Sum('quantity'))
+        basket_quantity = Coalesce(
+            Subquery(basket.values('total'), output_field=IntegerField()), 0
+        )
+        below_threshold = Q(quantity__lt=F('threshold'))
+        shortfall = Case(
+            When(below_threshold, then=F('threshold') - F('quantity')),
+            default=0,
+            output_field=IntegerField()
+        )
+        to_buy = Case(
+            When(
+                below_threshold & Q(kanban=True),
+                then=Coalesce(F('re_order'), 0) - F('basket_quantity')
+            ),
+            default=0,
+            output_field=IntegerField()
+        )
+        return self.annotate(
+            basket_quantity=basket_quantity, shortfall=shortfall
+        ).annotate(to_buy=to_buy)
+
+    # ingredients that need restocking
+    # to_buy is only non-zero for reorder items below threshold, filtering
+    # on those first lets the database use ingredient_kanban_idx
+    def shopping_list(self):
+        below_threshold = self.filter(kanban=True, quantity__lt=F('threshold'))
+        return below_threshold.with_shopping().exclude(to_buy=0)
+
+    # annotate ledger_quantity, the stock at a point in time from the ledger
+    def with_stock_at(self, when=None):
+        return self.annotate(ledger_quantity=ledger_stock(when))
+
+    # set quantity to the current stock in the ledger in one UPDATE
+    def refresh_stock(self):
+        return self.update(quantity=ledger_stock())
+
+    # annotate how many recipes use each ingredient
+    # and how many of those are for stocked dishes
+    def with_recipe_counts(self):
+        stocked = Q(recipe__menu_item__stock_item=True)
+        return self.annotate(
+            recipe_count=Count('recipe'),
+            stocked_count=Count('recipe', filter=stocked),
+        )
+
+
 class Ingredient(models.Model):
     class Meta:
         ordering = ['name']
+        indexes = [
+            # current stock and the stock take formset
+            models.Index(
+                fields=['name'],
+                condition=Q(quantity__gt=0),
+                name='ingredient_in_stock_idx',
+            ),
+            # shopping list: reorder items below threshold
+            models.Index(
+                fields=['quantity', 'threshold'],
+                condition=Q(kanban=True),
+                name='ingredient_kanban_idx',
+            ),
+        ]
+
+    objects = IngredientQuerySet.as_manager()
 
     name = models.CharField(unique=True, max_length=200)
     quantity = models.PositiveIntegerField(blank=True, null=True)
@@ -42,9 +166,55 @@ class Ingredient(models.Model):
     threshold = models.IntegerField(blank=True, null=True, verbose_name='Reorder Threshold')
     re_order = models.IntegerField(blank=True, null=True, verbose_name='Reorder Quantity')
 
+    # remember unit_price as loaded so a save can tell if it has changed
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_unit_price = instance.__dict__.get('unit_price')
+        return instance
+
+    # a saved quantity is a stock take (see ingredient_counted in signals.py)
+    # the stock it replaces is read from the ledger under lock in the save's
+    # transaction, so stock sold since this ingredient was loaded is counted
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        using = kwargs.get('using') or router.db_for_write(Ingredient, instance=self)
+        with transaction.atomic(using=using):
+            self._counted_from = None
+            if self.pk is not None and (update_fields is None or 'quantity' in update_fields):
+                counted = Ingredient.objects.using(using).filter(pk=self.pk)
+                counted = counted.select_for_update().with_stock_at()
+                self._counted_from = counted.values_list(
+                    'ledger_quantity', flat=True
+                ).first()
+            super().save(*args, **kwargs)
+
+    # True if unit_price differs from the value loaded from the database
+    def unit_price_changed(self):
+        if not hasattr(self, '_loaded_unit_price'):
+            return True
+        return self._loaded_unit_price != self.unit_price
+
+    # Takes wasted stock off and records it in the ledger
+    def waste(self, quantity):
+        with transaction.atomic():
+            if settings.INVENTORY_APPEND_STOCK:
+                refresh_stock_on_commit([self.pk])
+            else:
+                Ingredient.objects.filter(pk=self.pk).update(
+                    quantity=Coalesce(F('quantity'), 0) - quantity
+                )
+            StockMovement.objects.record(StockMovement.WASTE, [(self.pk, -quantity)])
+        bump_version()
+        stock_changed_on_commit()
+        self.refresh_from_db(fields=['quantity'])
+
     # Returns reorder quantity less basket quantity
     # if kanban is true and stock is below threshold
+    # uses the with_shopping() annotation when it is present
     def buy(self):
+        if hasattr(self, 'to_buy'):
+            return self.to_buy
         if self.kanban and self.quantity < self.threshold:
             return self.re_order - self.in_basket()
         else:
@@ -52,15 +222,16 @@ class Ingredient(models.Model):
 
     # return basket quantity if item is in the basket else zero
     def in_basket(self):
-        ingredients = [obj.ingredient for obj in Basket.objects.all()]
-        if self in ingredients:
-            basket = get_object_or_404(Basket, ingredient=self)
-            return basket.quantity
-        else:
-            return 0
+        if hasattr(self, 'basket_quantity'):
+            return self.basket_quantity
+        total = self.basket_set.aggregate(total=Sum('quantity'))['total']
+        return total or 0
 
     # return 'True' if it's not in a recipe
+    # uses the with_recipe_counts() annotation when it is present
     def no_recipe(self):
+        if hasattr(self, 'recipe_count'):
+            return self.recipe_count == 0
         recipes = self.recipe_set.all()
         if len(recipes) == 0:
             return True
@@ -69,7 +240,10 @@ class Ingredient(models.Model):
 
     # return 'True' if ingredient appears in only one recipe
     # and stock_item for that recipe is False
+    # uses the with_recipe_counts() annotation when it is present
     def non_stock(self):
+        if hasattr(self, 'recipe_count'):
+            return self.recipe_count == 1 and self.stocked_count == 0
         recipes = self.recipe_set.all()
         if len(recipes) == 1 and recipes[0].menu_item.stock_item == False:
             return True
@@ -83,10 +257,49 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.unit}'
 
 
+# output field of a dish cost: unit_price (3dp) multiplied by quantity (3dp)
+COST_FIELD = models.DecimalField(max_digits=16, decimal_places=6)
+LEDGER_FIELD = models.DecimalField(max_digits=16, decimal_places=3)
+
+
+# correlated subquery summing unit_price * quantity over a menu_item's recipe
+def recipe_cost():
+    recipe = Recipe.objects.filter(menu_item=OuterRef('pk')).order_by()
+    total = Sum(F('ingredient__unit_price') * F('quantity'))
+    recipe = recipe.values('menu_item').annotate(total=total)
+    return Subquery(recipe.values('total'), output_field=COST_FIELD)
+
+
+class MenuItemQuerySet(models.QuerySet):
+    # annotate each menu_item with how many can be made from stock
+    # floor(min(stock / recipe quantity)) in a single grouped query
+    # dishes with no recipe, or missing stock, are not available
+    def with_availability(self):
+        stock = Cast(
+            Coalesce(F('recipe__ingredient__quantity'), 0),
+            output_field=FloatField()
+        )
+        portions = Min(stock / F('recipe__quantity'), output_field=FloatField())
+        availability = Coalesce(Floor(portions), 0, output_field=IntegerField())
+        return self.annotate(availability=availability)
+
+    # annotate cost of ingredients worked out from the recipe
+    # (ignores the cached cost column)
+    def with_recipe_cost(self):
+        return self.annotate(recipe_cost=recipe_cost())
+
+    # recalculate the cached cost column of every menu_item in the queryset
+    # in a single UPDATE
+    def update_costs(self):
+        return self.update(cost=recipe_cost())
+
+
 class MenuItem(models.Model):
     class Meta:
         ordering = ['title']
 
+    objects = MenuItemQuerySet.as_manager()
+
     title = models.CharField(unique=True, max_length=200)
     price = models.DecimalField(max_digits=6, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
@@ -96,9 +309,16 @@ class MenuItem(models.Model):
     description = models.TextField(blank=True, null=True)
     # whether the dish is stocked or not
     stock_item = models.BooleanField(default=True)
+    # cost of ingredients, kept current by signals (see signals.py)
+    cost = models.DecimalField(
+        blank=True, null=True, editable=False, max_digits=16, decimal_places=6
+    )
 
     # Returns how many of the menu_item can be made from stock
+    # uses the with_availability() annotation when it is present
     def available(self):
+        if hasattr(self, 'availability'):
+            return int(self.availability)
         try:
             recipe = self.recipe_set.all()
             expression = F('ingredient__quantity') / F('quantity')
@@ -109,27 +329,56 @@ class MenuItem(models.Model):
 
     # Adjusts stock of ingredients of menu_item object
     # Delta is an integer: positive increases stock
+    # every recipe line is changed by one UPDATE inside a transaction
+    # taking stock locks the ingredient rows and re-checks availability
+    # so concurrent orders can't both take the last portion
+    # returns False when there isn't enough stock; a database error, such
+    # as a lock timeout, is raised rather than passed off as short stock
     def adjust_stock(self, delta):
         delta = delta or 0
-        try:
-            recipe = self.recipe_set.all()
-            for item in recipe:
-                pk = item.ingredient.pk
-                quantity = F('quantity') + item.quantity * delta
-                Ingredient.objects.filter(pk=pk).update(quantity=quantity)
-            return True
-        except:
-            return False
+        with transaction.atomic():
+            recipe = Recipe.objects.filter(menu_item=self)
+            ingredients = Ingredient.objects.filter(
+                pk__in=recipe.values('ingredient')
+            )
+            if delta < 0:
+                list(ingredients.select_for_update().values_list('pk'))
+                if -delta > self.available_to_sell():
+                    return False
+            if settings.INVENTORY_APPEND_STOCK:
+                refresh_stock_on_commit(ingredients.values_list('pk', flat=True))
+            else:
+                portion = recipe.filter(ingredient=OuterRef('pk')).values('quantity')
+                ingredients.update(quantity=F('quantity') + Subquery(portion) * delta)
+            StockMovement.objects.record(StockMovement.PURCHASE, [
+                (ingredient, quantity * delta)
+                for ingredient, quantity
+                in recipe.values_list('ingredient', 'quantity')
+            ])
+        bump_version()
+        stock_changed_on_commit()
+        # any availability annotation is now out of date
+        self.__dict__.pop('availability', None)
+        return True
+
+    # how many can be sold right now: while stock is appended its quantity
+    # may not be refreshed yet, so it is read from the ledger
+    def available_to_sell(self):
+        if not settings.INVENTORY_APPEND_STOCK:
+            menu = MenuItem.objects.filter(pk=self.pk).with_availability()
+            return menu.values_list('availability', flat=True).get()
+        recipe = Recipe.objects.filter(menu_item=self)
+        ingredients = Ingredient.objects.filter(pk__in=recipe.values('ingredient'))
+        stock = dict(ingredients.with_stock_at().values_list('pk', 'ledger_quantity'))
+        return min((
+            math.floor(stock[ingredient] / quantity)
+            for ingredient, quantity in recipe.values_list('ingredient', 'quantity')
+        ), default=0)
 
     # Returns cost of ingredients for a particular menu_item
+    # read from the cached cost column
     def dish_cost(self):
-        try:
-            ingredients = self.recipe_set.all()
-            total = Sum(F('ingredient__unit_price') * F('quantity'))
-            result = ingredients.aggregate(total=total)['total']
-        except:
-            result = 0
-        return result
+        return self.cost
 
     # Returns profit for a particular menu_item (called from template)
     def dish_profit(self):
@@ -139,22 +388,49 @@ class MenuItem(models.Model):
             profit = 0
         return profit
 
+    # remember stock_item as loaded so a save can tell if it has changed
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stock_item = instance.__dict__.get('stock_item')
+        return instance
+
+    # True if stock_item differs from the value loaded from the database
+    def stock_item_changed(self):
+        if not hasattr(self, '_loaded_stock_item'):
+            return True
+        return self._loaded_stock_item != self.stock_item
+
     # overrides ingredient.kanban according to menu_item.stock_item status
+    # only runs when stock_item has changed, as two set-based updates
+    # cost belongs to the signals: saving a loaded dish leaves it out, so a
+    # stale cost held in memory can't overwrite theirs
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'cost'
+            ]
+        changed = self.stock_item_changed() and (
+            update_fields is None or 'stock_item' in update_fields
+        )
         super().save(*args, **kwargs)
+        self._loaded_stock_item = self.stock_item
+        if not changed:
+            return self
 
+        recipe = Recipe.objects.filter(menu_item=self)
+        ingredients = Ingredient.objects.filter(pk__in=recipe.values('ingredient'))
         # if dish is stocked then set each ingredient kanban to 'True'
         if self.stock_item == True:
-            for obj in self.recipe_set.all():
-                obj.ingredient.kanban = True
-                obj.ingredient.save()
+            ingredients.update(kanban=True)
         else:
-            for obj in self.recipe_set.all():
-                # if ingredient is unique in this recipe only
-                # set ingredient kanban to 'False' for unique items
-                if len(Recipe.objects.filter(ingredient=obj.ingredient)) == 1:
-                    obj.ingredient.kanban = False
-                    obj.ingredient.save()
+            # if ingredient is unique in this recipe only
+            # set ingredient kanban to 'False' for unique items
+            unique = Recipe.objects.order_by().values('ingredient')
+            unique = unique.annotate(recipe_count=Count('pk')).filter(recipe_count=1)
+            ingredients.filter(pk__in=unique.values('ingredient')).update(kanban=False)
         return self
 
     def get_absolute_url(self):
@@ -185,9 +461,33 @@ class Recipe(models.Model):
 
 # unique table & timestamp 'order number'
 # can assign a TableOrder to a Purchase object
+class TableOrderQuerySet(models.QuerySet):
+    # table orders placed in [since, until) and/or at a table
+    def for_period(self, since=None, until=None, table=None):
+        table_orders = self
+        if since is not None:
+            table_orders = table_orders.filter(timestamp__gte=since)
+        if until is not None:
+            table_orders = table_orders.filter(timestamp__lt=until)
+        if table is not None:
+            table_orders = table_orders.filter(table_num=table)
+        return table_orders
+
+
 class TableOrder(models.Model):
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # customer order list and date range reports
+            models.Index(fields=['-timestamp'], name='tableorder_timestamp_idx'),
+            # reports filtered by table and date range
+            models.Index(
+                fields=['table_num', 'timestamp'],
+                name='tableorder_table_time_idx',
+            ),
+        ]
+
+    objects = TableOrderQuerySet.as_manager()
 
     timestamp = models.DateTimeField(default=timezone.now)
     table = models.ForeignKey(
@@ -211,10 +511,66 @@ class TableOrder(models.Model):
         return f'Table: {self.table_num} -- {self.timestamp}'
 
 
+# output field of sales sums: price (2dp) or cost (6dp) multiplied by quantity
+MONEY_FIELD = models.DecimalField(max_digits=20, decimal_places=6)
+
+
+class PurchaseQuerySet(models.QuerySet):
+    # purchases on table orders placed in [since, until) and/or at a table
+    def for_period(self, since=None, until=None, table=None):
+        purchases = self
+        if since is not None:
+            purchases = purchases.filter(table_order__timestamp__gte=since)
+        if until is not None:
+            purchases = purchases.filter(table_order__timestamp__lt=until)
+        if table is not None:
+            purchases = purchases.filter(table_order__table_num=table)
+        return purchases
+
+    # revenue, cost and profit of the purchases in one aggregate query
+    # cost uses the cached menu_item cost so recipes aren't joined per row
+    def sales_totals(self):
+        revenue = Sum(F('menu_item__price') * F('quantity'), output_field=MONEY_FIELD)
+        cost = Sum(F('menu_item__cost') * F('quantity'), output_field=MONEY_FIELD)
+        totals = self.order_by().aggregate(
+            revenue=Coalesce(revenue, Decimal(0)),
+            cost=Coalesce(cost, Decimal(0)),
+        )
+        totals['profit'] = totals['revenue'] - totals['cost']
+        return {
+            key: value.quantize(Decimal('0.01'))
+            for key, value in totals.items()
+        }
+
+    # top selling dishes ranked by 'quantity' or 'revenue' in one GROUP BY
+    # grouped on menu_item_name so sales of deleted dishes still count
+    def best_sellers(self, by='quantity', limit=10):
+        revenue = Sum(F('menu_item__price') * F('quantity'), output_field=MONEY_FIELD)
+        ranked = self.order_by().values('menu_item_name').annotate(
+            total_quantity=Sum('quantity'),
+            total_revenue=Coalesce(revenue, Decimal(0)),
+        )
+        return ranked.order_by(f'-total_{by}', 'menu_item_name')[:limit]
+
+
 # used to store customer purchases from the menu
 class Purchase(models.Model):
     class Meta:
         ordering = ['menu_item_name']
+        indexes = [
+            # purchases on a table order, listed by dish name
+            models.Index(
+                fields=['table_order', 'menu_item_name'],
+                name='purchase_order_name_idx',
+            ),
+            # best sellers grouped by dish name
+            models.Index(
+                fields=['menu_item_name', 'quantity'],
+                name='purchase_name_quantity_idx',
+            ),
+        ]
+
+    objects = PurchaseQuerySet.as_manager()
 
     table_order = models.ForeignKey(TableOrder, null=True, on_delete=models.CASCADE)
     menu_item = models.ForeignKey(
@@ -242,22 +598,103 @@ class Purchase(models.Model):
 
 
 # use this model to hold the shopping basket
+# vendors with INSERT ... ON CONFLICT DO UPDATE, and whether they can
+# return the resulting row from it
+def _upsert_features(connection):
+    if connection.vendor == 'postgresql':
+        return True, True
+    if connection.vendor == 'sqlite':
+        version = connection.Database.sqlite_version_info
+        return version >= (3, 24), version >= (3, 35)
+    return False, False
+
+
+class BasketQuerySet(models.QuerySet):
+    # Adds quantity to the ingredient's basket line, creating the line if
+    # there isn't one, and returns the line as saved
+    # a single upsert where the database supports it, otherwise a locking
+    # UPDATE then INSERT, so concurrent adds are never lost
+    # every query is on the write database, even while reporting
+    def add(self, ingredient, quantity):
+        ingredient_id = getattr(ingredient, 'pk', ingredient)
+        lines = self.using(self._db or router.db_for_write(self.model))
+        connection = connections[lines.db]
+        upsert, returning = _upsert_features(connection)
+        # the row to insert is checked even when it conflicts,
+        # so removals only update
+        if upsert and quantity > 0:
+            line = lines._upsert(connection, ingredient_id, quantity, returning)
+        else:
+            line = lines._update_or_insert(ingredient_id, quantity)
+        # raw SQL and queryset updates send no signals
+        bump_version()
+        return line
+
+    def _upsert(self, connection, ingredient_id, quantity, returning):
+        opts = self.model._meta
+        table = connection.ops.quote_name(opts.db_table)
+        pk = connection.ops.quote_name(opts.pk.column)
+        column = connection.ops.quote_name(opts.get_field('ingredient').column)
+        sql = (
+            f'INSERT INTO {table} ({column}, quantity) VALUES (%s, %s) '
+            f'ON CONFLICT ({column}) '
+            f'DO UPDATE SET quantity = {table}.quantity + excluded.quantity'
+        )
+        with connection.cursor() as cursor:
+            if returning:
+                cursor.execute(f'{sql} RETURNING {pk}, quantity',
+                               [ingredient_id, quantity])
+                line_pk, total = cursor.fetchone()
+                return self.model(pk=line_pk, ingredient_id=ingredient_id,
+                                  quantity=total)
+            cursor.execute(sql, [ingredient_id, quantity])
+        return self.get(ingredient_id=ingredient_id)
+
+    # the UPDATE locks an existing line; if there is none it is inserted,
+    # falling back to the UPDATE if another request inserted it first
+    def _update_or_insert(self, ingredient_id, quantity):
+        lines = self.filter(ingredient_id=ingredient_id)
+        with transaction.atomic(using=self.db):
+            if lines.update(quantity=F('quantity') + quantity):
+                return lines.get()
+            try:
+                with transaction.atomic(using=self.db):
+                    return self.create(ingredient_id=ingredient_id,
+                                       quantity=quantity)
+            except IntegrityError:
+                if not lines.update(quantity=F('quantity') + quantity):
+                    raise
+            return lines.get()
+
+
 class Basket(models.Model):
+    class Meta:
+        constraints = [
+            # an ingredient has at most one basket line
+            models.UniqueConstraint(
+                fields=['ingredient'], name='unique_basket_ingredient'
+            ),
+        ]
+
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(
         default=1,
         validators=[MinValueValidator(1)]
     )
 
+    objects = BasketQuerySet.as_manager()
+
     # Adjusts quantity of basket object
     # Delta is an integer: positive for increase
+    # added in the database, so it can't overwrite a concurrent change
     def change_quantity(self, delta):
         try:
-            self.quantity += delta
-            self.save()
-            return True
-        except:
+            with transaction.atomic():
+                line = Basket.objects.add(self.ingredient_id, delta)
+        except DatabaseError:
             return False
+        self.pk, self.quantity = line.pk, line.quantity
+        return True
 
     def get_absolute_url(self):
         return reverse('basket_view')
@@ -278,25 +715,45 @@ class OrderNumber(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
 
     # perform actions when model is saved (when an order is created)
+    # the basket is flushed as one batch inside a transaction
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # move contents of basket over into a new order
+            basket = Basket.objects.select_related('ingredient').order_by('pk')
+            items = list(basket.select_for_update())
+            Order.objects.bulk_create([
+                Order(
+                    order_number=self,
+                    ingredient_name=item.ingredient.name,
+                    quantity=item.quantity
+                )
+                for item in items
+            ])
+
+            # increment stock of items ordered
+            flushed = Basket.objects.filter(pk__in=[item.pk for item in items])
+            if settings.INVENTORY_APPEND_STOCK:
+                refresh_stock_on_commit(item.ingredient_id for item in items)
+            else:
+                delivered = flushed.filter(ingredient=OuterRef('pk')).order_by()
+                delivered = delivered.values('ingredient').annotate(total=Sum('quantity'))
+                Ingredient.objects.filter(
+                    pk__in=flushed.values('ingredient')
+                ).update(
+                    quantity=Coalesce(F('quantity'), 0)
+                    + Subquery(delivered.values('total'))
+                )
+
+            StockMovement.objects.record(StockMovement.DELIVERY, [
+                (item.ingredient_id, item.quantity) for item in items
+            ])
 
-        # move contents of basket over into a new order
-        # and increment stock of items ordered
-        order_number = OrderNumber.objects.latest('id')
-        basket = Basket.objects.all()
-        for item in basket:
-            # copy basket contents into Order
-            Order.objects.create(
-                order_number=order_number,
-                ingredient_name=item.ingredient.name,
-                quantity=item.quantity
-            )
-            # increment stock
-            item.ingredient.quantity += item.quantity
-            item.ingredient.save()
             # remove from basket
-            item.delete()
+            flushed.delete()
+        bump_version()
+        stock_changed_on_commit()
 
     def get_absolute_url(self):
         return reverse('shopping_list')
@@ -306,10 +763,23 @@ class OrderNumber(models.Model):
 
 
 # use ths model to store shopping lists after 'purchase'
+class OrderQuerySet(models.QuerySet):
+    # order lines of orders made in [since, until)
+    def for_period(self, since=None, until=None):
+        orders = self
+        if since is not None:
+            orders = orders.filter(order_number__timestamp__gte=since)
+        if until is not None:
+            orders = orders.filter(order_number__timestamp__lt=until)
+        return orders
+
+
 class Order(models.Model):
     class Meta:
         ordering = ['order_number']
 
+    objects = OrderQuerySet.as_manager()
+
     order_number = models.ForeignKey(OrderNumber, on_delete=models.CASCADE)
     ingredient_name = models.CharField(blank=True, max_length=200)
     quantity = models.PositiveIntegerField(
@@ -322,3 +792,145 @@ class Order(models.Model):
 
     def __str__(self):
         return f'{self.id} -- {self.ingredient_name}'
+
+
+# A bulk stock take, see stocktake.py
+# its adjustments record every quantity it changed, for audit
+class StockTake(models.Model):
+    class Meta:
+        ordering = ['-id']
+
+    timestamp = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        models.SET_NULL,
+        blank=True,
+        null=True
+    )
+
+    def __str__(self):
+        return f'{self.id} -- {self.timestamp}'
+
+
+# ingredient name is kept in case the ingredient is deleted
+class StockAdjustment(models.Model):
+    stock_take = models.ForeignKey(StockTake, on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(
+        Ingredient,
+        models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    ingredient_name = models.CharField(max_length=200)
+    old_quantity = models.PositiveIntegerField(blank=True, null=True)
+    new_quantity = models.PositiveIntegerField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.ingredient_name}: {self.old_quantity} -> {self.new_quantity}'
+
+
+class StockMovementQuerySet(models.QuerySet):
+    # appends a movement for each (ingredient id, change) pair in one insert
+    def record(self, kind, changes, timestamp=None):
+        timestamp = timestamp or timezone.now()
+        return self.bulk_create([
+            self.model(
+                ingredient_id=ingredient,
+                kind=kind,
+                quantity=change,
+                timestamp=timestamp,
+            )
+            for ingredient, change in changes if change
+        ], batch_size=500)
+
+
+# Append-only ledger of every change to stock
+# Ingredient.quantity stays the materialized current stock that pages and
+# availability read; it is updated in the same transaction as each movement
+# is recorded or, with INVENTORY_APPEND_STOCK, refreshed from the ledger
+# after it commits, and the ledger adds history and stock at any point in
+# time (Ingredient.objects.with_stock_at())
+class StockMovement(models.Model):
+    PURCHASE = 'purchase'
+    DELIVERY = 'delivery'
+    STOCK_TAKE = 'stock_take'
+    WASTE = 'waste'
+    KIND_CHOICES = [
+        (PURCHASE, 'Purchase'),
+        (DELIVERY, 'Delivery'),
+        (STOCK_TAKE, 'Stock take'),
+        (WASTE, 'Waste'),
+    ]
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            # stock of an ingredient at a point in time
+            models.Index(
+                fields=['ingredient', 'timestamp'],
+                name='movement_ingredient_time_idx',
+            ),
+        ]
+
+    objects = StockMovementQuerySet.as_manager()
+
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # signed change, negative when stock is used
+    quantity = models.DecimalField(max_digits=16, decimal_places=3)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.ingredient} {self.kind} {self.quantity}'
+
+
+class StockSnapshotQuerySet(models.QuerySet):
+    # Folds the movements since each ingredient's last snapshot into a new
+    # one, so point-in-time stock only sums the movements after it
+    # movements younger than lag are left for the next snapshot, so one
+    # from a transaction still in flight can't be passed over
+    # returns the number of snapshots taken
+    def take(self, lag=timedelta(minutes=1)):
+        cutoff = timezone.now() - lag
+        with transaction.atomic():
+            previous = self.aggregate(last=Max('last_movement'))['last'] or 0
+            movements = StockMovement.objects.filter(timestamp__lte=cutoff)
+            last = movements.aggregate(last=Max('pk'))['last'] or 0
+            if last <= previous:
+                return 0
+            moved = movements.filter(pk__gt=previous, pk__lte=last)
+            ingredients = Ingredient.objects.filter(
+                pk__in=moved.values('ingredient')
+            ).annotate(ledger_quantity=ledger_stock(last_movement=last))
+            snapshots = self.bulk_create([
+                self.model(
+                    ingredient_id=ingredient,
+                    quantity=quantity,
+                    last_movement=last,
+                    timestamp=cutoff,
+                )
+                for ingredient, quantity
+                in ingredients.values_list('pk', 'ledger_quantity')
+            ], batch_size=500)
+        return len(snapshots)
+
+
+# Stock of an ingredient folded from every movement up to last_movement
+class StockSnapshot(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'last_movement'],
+                name='snapshot_ingredient_idx',
+            ),
+        ]
+
+    objects = StockSnapshotQuerySet.as_manager()
+
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    quantity = models.DecimalField(max_digits=16, decimal_places=3)
+    last_movement = models.PositiveBigIntegerField(default=0)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.ingredient} {self.quantity} at {self.timestamp}'
@@ -0,0 +1,140 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+# Cursor tokens are the ordering values of the row at the edge of a page,
+# as url safe base64 JSON
+def encode_cursor(values):
+    data = json.dumps(values, default=str).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(token, model, fields):
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        raise Http404('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise Http404('Invalid cursor')
+    try:
+        return [
+            model._meta.get_field(name).to_python(value)
+            for name, value in zip(fields, values)
+        ]
+    except ValidationError:
+        raise Http404('Invalid cursor')
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = self.previous_url = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+# Seek pagination: each page is found from the ordering values of the last
+# (or first) row of its neighbour, never by counting or OFFSET, so every page
+# costs one indexed query however far back it is
+# ordering must end in a unique field, e.g. ('-timestamp', '-id')
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in ordering]
+
+    # rows after (or before) the cursor in ordering
+    def _seek(self, values, forward):
+        query = Q()
+        for i, name in enumerate(self.ordering):
+            field = self.fields[i]
+            descending = name.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            condition = Q(**{f'{field}__{lookup}': values[i]})
+            for prior, value in zip(self.fields[:i], values):
+                condition &= Q(**{prior: value})
+            query |= condition
+        return query
+
+    def _cursor(self, obj):
+        values = []
+        for name in self.fields:
+            field = self.queryset.model._meta.get_field(name)
+            values.append(field.value_from_object(obj))
+        return encode_cursor(values)
+
+    def page(self, after=None, before=None):
+        model = self.queryset.model
+        if before:
+            values = decode_cursor(before, model, self.fields)
+            reverse = [
+                name[1:] if name.startswith('-') else f'-{name}'
+                for name in self.ordering
+            ]
+            queryset = self.queryset.filter(self._seek(values, False))
+            rows = list(queryset.order_by(*reverse)[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            # there is a page after this one: the one we came from
+            next_cursor = self._cursor(rows[-1]) if rows else None
+            previous_cursor = self._cursor(rows[0]) if more else None
+            return KeysetPage(rows, next_cursor, previous_cursor)
+
+        queryset = self.queryset
+        if after:
+            values = decode_cursor(after, model, self.fields)
+            queryset = queryset.filter(self._seek(values, True))
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        next_cursor = self._cursor(rows[-1]) if more else None
+        previous_cursor = self._cursor(rows[0]) if after and rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+# ListView mixin replacing page-number pagination with keyset pagination
+# set keyset_ordering and paginate_by; the page takes ?after= or ?before=
+# cursor tokens and keeps any other query parameters, such as filters
+class KeysetPaginationMixin:
+    keyset_ordering = ('-id',)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, self.keyset_ordering, page_size)
+        page = paginator.page(
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+        )
+        if page.has_next():
+            page.next_url = self.page_url('after', page.next_cursor)
+        if page.has_previous():
+            page.previous_url = self.page_url('before', page.previous_cursor)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def page_url(self, key, cursor):
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query[key] = cursor
+        return f'?{query.urlencode()}'
@@ -0,0 +1,135 @@
+import re
+import threading
+import time
+
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+# IN lists of different lengths should share a fingerprint
+IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+# SQL with parameters and literals replaced, so repeated queries match
+def fingerprint(sql):
+    return NUMBER.sub('N', IN_LIST.sub('(...)', sql))
+
+
+# Records every query run on any database connection while active
+class QueryProfile:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    # total time spent in the database in milliseconds
+    @property
+    def db_ms(self):
+        return sum(duration for sql, duration in self.queries) * 1000
+
+    # fingerprints run more than once, the signature of an N+1
+    def duplicates(self):
+        counts = Counter(fingerprint(sql) for sql, duration in self.queries)
+        return {sql: count for sql, count in counts.items() if count > 1}
+
+
+# Rolling per-view aggregate of recent profiles held in process memory
+class ProfileStats:
+    def __init__(self, size=100):
+        self.size = size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = defaultdict(lambda: deque(maxlen=self.size))
+            self.duplicates = defaultdict(Counter)
+
+    def record(self, view, profile, render_ms, total_ms):
+        with self.lock:
+            self.samples[view].append(
+                (profile.count, profile.db_ms, render_ms, total_ms)
+            )
+            self.duplicates[view].update(profile.duplicates())
+
+    # views with average timings, most queries first
+    def report(self, top=5):
+        with self.lock:
+            rows = []
+            for view, samples in self.samples.items():
+                n = len(samples)
+                rows.append({
+                    'view': view,
+                    'requests': n,
+                    'avg_queries': round(sum(s[0] for s in samples) / n, 1),
+                    'max_queries': max(s[0] for s in samples),
+                    'avg_db_ms': round(sum(s[1] for s in samples) / n, 3),
+                    'avg_render_ms': round(sum(s[2] for s in samples) / n, 3),
+                    'avg_total_ms': round(sum(s[3] for s in samples) / n, 3),
+                    'duplicates': self.duplicates[view].most_common(top),
+                })
+        return sorted(rows, key=lambda row: -row['avg_queries'])
+
+
+stats = ProfileStats()
+
+
+# Opt-in per-request query profiler, enabled by settings.INVENTORY_PROFILER
+# adds a Server-Timing header and records each request in `stats`
+# when disabled Django drops it from the middleware chain entirely
+class QueryProfilerMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'INVENTORY_PROFILER', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with QueryProfile() as profile:
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+        render_ms = getattr(request, '_profiler_render_ms', 0)
+
+        match = request.resolver_match
+        view = match.view_name if match else request.path_info
+        stats.record(view, profile, render_ms, total_ms)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={profile.db_ms:.3f};desc="{profile.count} queries"',
+            f'render;dur={render_ms:.3f}',
+            f'total;dur={total_ms:.3f}',
+        ])
+        return response
+
+    # time template rendering, which happens after the view returns
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def rendered(response):
+            request._profiler_render_ms = (time.perf_counter() - start) * 1000
+
+        response.add_post_render_callback(rendered)
+        return response
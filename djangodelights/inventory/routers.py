@@ -0,0 +1,81 @@
+import asyncio
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+# Read replica routing: reporting reads of inventory models go to the
+# database alias named by settings.INVENTORY_REPLICA, everything else,
+# and every write, to the primary
+# users and sessions are always read from the primary, which a replica
+# may lag behind
+
+_reporting = ContextVar('reporting', default=False)
+
+
+# inventory reads inside this block go to the replica, if there is one
+@contextmanager
+def reporting():
+    token = _reporting.set(True)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+def replica_alias():
+    return getattr(settings, 'INVENTORY_REPLICA', None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = replica_alias()
+        if replica and _reporting.get() and model._meta.app_label == 'inventory':
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    # the replica holds the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+async def _reporting_coroutine(coroutine):
+    with reporting():
+        return await coroutine
+
+
+def _reporting_iterator(iterator):
+    iterator = iter(iterator)
+    while True:
+        with reporting():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+# View mixin reading from the replica: the response is rendered, or each
+# chunk of a streaming response produced, while reporting
+class ReportingMixin:
+    def dispatch(self, request, *args, **kwargs):
+        if not replica_alias():
+            return super().dispatch(request, *args, **kwargs)
+        with reporting():
+            response = super().dispatch(request, *args, **kwargs)
+            # an async view (see asyncviews.py)
+            if asyncio.iscoroutine(response):
+                return _reporting_coroutine(response)
+            if response.streaming:
+                response.streaming_content = _reporting_iterator(
+                    response.streaming_content
+                )
+            elif hasattr(response, 'render'):
+                response.render()
+        return response
@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .live import publish_availability
+from .models import Basket, Category, Ingredient, MenuItem, Purchase, Recipe
+from .models import StockMovement, stock_changed, stock_changed_on_commit
+
+
+# recalculate dish cost when a recipe line is added, changed or removed
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    MenuItem.objects.filter(pk=instance.menu_item_id).update_costs()
+
+
+# recalculate cost of every dish using an ingredient whose price changed
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is not None and 'unit_price' not in update_fields:
+        return
+    if instance.unit_price_changed():
+        MenuItem.objects.filter(recipe__ingredient=instance).update_costs()
+    instance._loaded_unit_price = instance.unit_price
+
+
+# a quantity entered on the ingredient forms is recorded as a stock take
+# (other stock changes are queryset updates and record their own movements)
+@receiver(post_save, sender=Ingredient)
+def ingredient_counted(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'quantity' not in update_fields:
+        return
+    if created:
+        old = 0
+    elif getattr(instance, '_counted_from', None) is not None:
+        old = instance._counted_from
+    else:
+        return
+    change = (instance.quantity or 0) - old
+    StockMovement.objects.record(StockMovement.STOCK_TAKE, [(instance.pk, change)])
+    if change:
+        stock_changed_on_commit()
+
+
+# push the dishes whose availability changed to the live feed
+@receiver(stock_changed)
+def stock_published(sender, **kwargs):
+    publish_availability()
+
+
+# anything that changes stock, recipes or the menu invalidates the cache
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Purchase)
+@receiver(post_delete, sender=Purchase)
+@receiver(post_save, sender=Basket)
+@receiver(post_delete, sender=Basket)
+def inventory_changed(sender, **kwargs):
+    bump_version()
+
+
+# Tunes each new SQLite connection with the database profile's pragmas,
+# and with BEGIN set starts transactions in that mode, e.g. IMMEDIATE
+# (see SQLITE_PROFILES in settings.py)
+@receiver(connection_created)
+def sqlite_connected(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    profile = getattr(settings, 'INVENTORY_SQLITE', {})
+    for name, value in profile.get('PRAGMAS', {}).items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+    begin = profile.get('BEGIN')
+    if begin:
+        def start_transaction():
+            connection.cursor().execute(f'BEGIN {begin}')
+        connection._start_transaction_under_autocommit = start_transaction
+    else:
+        connection.__dict__.pop('_start_transaction_under_autocommit', None)
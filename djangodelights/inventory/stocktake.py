@@ -0,0 +1,151 @@
+import csv
+import io
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .cache import bump_version
+from .models import Ingredient, StockAdjustment, StockMovement, StockTake
+from .models import stock_changed_on_commit
+
+
+# Bulk stock take: counted quantities arrive as (ingredient name, quantity)
+# rows from a CSV upload, a JSON body or the stock formset; diff_stock_take()
+# checks them against the ingredients in one query and apply_stock_take()
+# writes the changes with one bulk update, recording them for audit and
+# in the stock ledger
+
+
+# rows of a CSV with ingredient and quantity columns, such as the stock export
+def read_csv(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.DictReader(text)
+        if not {'ingredient', 'quantity'} <= set(reader.fieldnames or []):
+            raise ValidationError('CSV needs ingredient and quantity columns')
+        return [(row['ingredient'], row['quantity']) for row in reader]
+    except (UnicodeDecodeError, csv.Error):
+        raise ValidationError('Not a readable CSV file')
+
+
+# rows of a JSON list of {"ingredient": ..., "quantity": ...} objects,
+# or of an object mapping ingredient names to quantities
+def read_json(data):
+    if isinstance(data, dict):
+        return list(data.items())
+    try:
+        return [(row['ingredient'], row['quantity']) for row in data]
+    except (KeyError, TypeError):
+        raise ValidationError('Rows need ingredient and quantity')
+
+
+# a blank quantity (None, or an empty CSV cell as the stock export writes
+# for no quantity) clears it, as in the stock formset
+def parse_quantity(value):
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        raise ValidationError(f'{value!r} is not a whole number')
+    if quantity < 0:
+        raise ValidationError('Quantity cannot be negative')
+    return quantity
+
+
+class StockTakeDiff:
+    def __init__(self):
+        self.changes = []       # (ingredient, old quantity, new quantity)
+        self.unchanged = 0
+        self.unknown = []       # names that aren't ingredients
+        self.invalid = []       # (row number, name, error)
+        self.duplicates = []
+
+    def is_valid(self):
+        return not (self.unknown or self.invalid or self.duplicates)
+
+    # the counted rows, to carry from the preview to the apply step
+    def rows(self):
+        return [(ingredient.name, new) for ingredient, old, new in self.changes]
+
+    def as_dict(self):
+        return {
+            'changes': [
+                {'ingredient': ingredient.name, 'old': old, 'new': new}
+                for ingredient, old, new in self.changes
+            ],
+            'unchanged': self.unchanged,
+            'unknown': self.unknown,
+            'invalid': [
+                {'row': row, 'ingredient': name, 'error': error}
+                for row, name, error in self.invalid
+            ],
+            'duplicates': self.duplicates,
+        }
+
+
+# Compares counted rows with current stock, fetching every named
+# ingredient in one query
+def diff_stock_take(rows, queryset=None):
+    diff = StockTakeDiff()
+    counted = {}
+    for number, (name, value) in enumerate(rows, 1):
+        name = (name or '').strip()
+        try:
+            quantity = parse_quantity(value)
+        except ValidationError as e:
+            diff.invalid.append((number, name, e.messages[0]))
+            continue
+        if name in counted:
+            diff.duplicates.append(name)
+        counted[name] = quantity
+
+    ingredients = queryset if queryset is not None else Ingredient.objects
+    found = ingredients.in_bulk(list(counted), field_name='name')
+    for name, quantity in counted.items():
+        ingredient = found.get(name)
+        if ingredient is None:
+            diff.unknown.append(name)
+        elif ingredient.quantity == quantity:
+            diff.unchanged += 1
+        else:
+            diff.changes.append((ingredient, ingredient.quantity, quantity))
+    return diff
+
+
+# Writes the changes of a valid diff in one transaction and returns the
+# StockTake recording them
+# the rows are locked and diffed again, so a stock change made since the
+# diff was shown is recorded as the old quantity it really replaced
+def apply_stock_take(diff, user=None):
+    if not diff.is_valid():
+        raise ValidationError('Stock take has errors')
+    with transaction.atomic():
+        locked = Ingredient.objects.select_for_update()
+        diff = diff_stock_take(diff.rows(), locked)
+        for ingredient, old, new in diff.changes:
+            ingredient.quantity = new
+        Ingredient.objects.bulk_update(
+            [ingredient for ingredient, old, new in diff.changes],
+            ['quantity'],
+            batch_size=500,
+        )
+        stock_take = StockTake.objects.create(user=user)
+        StockAdjustment.objects.bulk_create([
+            StockAdjustment(
+                stock_take=stock_take,
+                ingredient=ingredient,
+                ingredient_name=ingredient.name,
+                old_quantity=old,
+                new_quantity=new,
+            )
+            for ingredient, old, new in diff.changes
+        ], batch_size=500)
+        StockMovement.objects.record(StockMovement.STOCK_TAKE, [
+            (ingredient.pk, (new or 0) - (old or 0))
+            for ingredient, old, new in diff.changes
+        ], timestamp=stock_take.timestamp)
+    # bulk updates send no signals
+    bump_version()
+    stock_changed_on_commit()
+    return stock_take
@@ -0,0 +1,138 @@
+import random
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import Basket, Category, Ingredient, MenuItem, Recipe
+from .models import Order, OrderNumber, Purchase, StockMovement, Table, TableOrder
+
+
+# bulk_create and return the saved rows with primary keys
+# (not every backend sets pk on bulk created objects)
+def _bulk_create(model, objs):
+    last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+    model.objects.bulk_create(objs, batch_size=500)
+    return list(model.objects.filter(pk__gt=last or 0).order_by('pk'))
+
+
+# Fills the database with generated restaurant data for tests and benchmarks
+# prefix keeps names unique so it can be called again to grow the data
+# rows are bulk created, so model save() and signals are bypassed
+def generate(ingredients=50, dishes=20, recipe_lines=4, table_orders=50,
+             purchases=150, basket=10, orders=5, days=365, prefix='', seed=0):
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    with transaction.atomic():
+        categories = [
+            Category.objects.get_or_create(category=name)[0]
+            for name in ('Starters', 'Mains', 'Desserts', 'Drinks')
+        ]
+        tables = list(Table.objects.all()) or _bulk_create(
+            Table, [Table(table_num=num) for num in range(1, 11)]
+        )
+
+        ingredient_objs = _bulk_create(Ingredient, [
+            Ingredient(
+                name=f'{prefix}ingredient-{i}',
+                quantity=rng.randint(0, 5000),
+                unit='g',
+                unit_price=Decimal(rng.randint(1, 9999)) / 1000,
+                kanban=rng.random() < 0.5,
+                threshold=rng.randint(50, 500),
+                re_order=rng.randint(500, 2000),
+            )
+            for i in range(ingredients)
+        ])
+        StockMovement.objects.record(StockMovement.STOCK_TAKE, [
+            (obj.pk, obj.quantity) for obj in ingredient_objs
+        ])
+
+        menu_objs = _bulk_create(MenuItem, [
+            MenuItem(
+                title=f'{prefix}dish-{i}',
+                price=Decimal(rng.randint(200, 3000)) / 100,
+                category=rng.choice(categories),
+                display=rng.random() < 0.9,
+                description=f'Generated dish {i}',
+                stock_item=rng.random() < 0.7,
+            )
+            for i in range(dishes)
+        ])
+
+        lines = min(recipe_lines, len(ingredient_objs))
+        recipe_objs = [
+            Recipe(
+                menu_item=menu_item,
+                ingredient=ingredient,
+                quantity=Decimal(rng.randint(1, 500)) / 10,
+            )
+            for menu_item in menu_objs
+            for ingredient in rng.sample(ingredient_objs, lines)
+        ]
+        Recipe.objects.bulk_create(recipe_objs, batch_size=500)
+        if menu_objs:
+            MenuItem.objects.filter(pk__gte=menu_objs[0].pk).update_costs()
+
+        table_order_objs = []
+        for i in range(table_orders):
+            table = rng.choice(tables)
+            table_order_objs.append(TableOrder(
+                timestamp=now - timedelta(minutes=rng.randint(0, days * 24 * 60)),
+                table=table,
+                table_num=table.table_num,
+            ))
+        table_order_objs = _bulk_create(TableOrder, table_order_objs)
+
+        # spread purchases over table orders, one line per dish per order
+        purchase_objs = []
+        if table_order_objs and menu_objs:
+            per_order = max(1, purchases // len(table_order_objs))
+            per_order = min(per_order, len(menu_objs))
+            for table_order in table_order_objs:
+                for menu_item in rng.sample(menu_objs, per_order):
+                    if len(purchase_objs) == purchases:
+                        break
+                    purchase_objs.append(Purchase(
+                        table_order=table_order,
+                        menu_item=menu_item,
+                        menu_item_name=menu_item.title,
+                        quantity=rng.randint(1, 4),
+                    ))
+        Purchase.objects.bulk_create(purchase_objs, batch_size=500)
+
+        in_basket = set(Basket.objects.values_list('ingredient', flat=True))
+        free = [obj for obj in ingredient_objs if obj.pk not in in_basket]
+        Basket.objects.bulk_create([
+            Basket(ingredient=ingredient, quantity=rng.randint(1, 500))
+            for ingredient in rng.sample(free, min(basket, len(free)))
+        ], batch_size=500)
+
+        order_numbers = _bulk_create(OrderNumber, [
+            OrderNumber(timestamp=now - timedelta(days=rng.randint(0, days)))
+            for i in range(orders)
+        ])
+        per_order = min(5, len(ingredient_objs))
+        Order.objects.bulk_create([
+            Order(
+                order_number=order_number,
+                ingredient_name=ingredient.name,
+                quantity=rng.randint(1, 500),
+            )
+            for order_number in order_numbers
+            for ingredient in rng.sample(ingredient_objs, per_order)
+        ], batch_size=500)
+
+    # bulk_create sends no signals
+    bump_version()
+    return {
+        'ingredients': len(ingredient_objs),
+        'dishes': len(menu_objs),
+        'recipe_lines': len(recipe_objs),
+        'table_orders': len(table_order_objs),
+        'purchases': len(purchase_objs),
+    }
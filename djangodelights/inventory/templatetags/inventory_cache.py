@@ -0,0 +1,35 @@
+from django import template
+
+from inventory.cache import get_or_set
+
+register = template.Library()
+
+
+# {% inventory_cache 'name' [vary_on ...] %} ... {% endinventory_cache %}
+# caches the rendered fragment until the inventory version changes
+@register.tag('inventory_cache')
+def do_inventory_cache(parser, token):
+    nodelist = parser.parse(('endinventory_cache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' tag requires at least 1 argument."
+        )
+    name = parser.compile_filter(bits[1])
+    vary_on = [parser.compile_filter(bit) for bit in bits[2:]]
+    return InventoryCacheNode(nodelist, name, vary_on)
+
+
+class InventoryCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return get_or_set(
+            f'fragment:{name}', lambda: self.nodelist.render(context), vary_on
+        )
@@ -1,3 +1,1466 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import threading
+import tracemalloc
 
-# Create your tests here.
+from datetime import datetime
+from decimal import Decimal
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections
+from django.db.models import QuerySet
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from djangodelights.asgi import application
+
+from .models import Basket, Category, Ingredient, MenuItem, Order, Purchase, TableOrder
+from .models import OrderNumber, Recipe, StockAdjustment, StockMovement, StockSnapshot
+from .models import IngredientQuerySet, Table
+from .async_urls import ASYNC_VIEWS
+from .asyncviews import run_queries
+from .bom import get_bom
+from .live import RESYNC, STREAM_PATH, _offer, broadcaster
+from .menu import menu_sections
+from .profiler import QueryProfile, stats
+from .routers import ReplicaRouter, reporting
+from .synthetic import generate
+from .views import STOCK_UNAVAILABLE
+
+
+# a logged in staff user and a generated dataset of DATA's sizes
+class InventoryTestMixin:
+    DATA = {}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            'manager', password='manager', is_staff=True
+        )
+        self.client.force_login(self.user)
+        generate(**self.DATA)
+
+
+class ShoppingListTests(TestCase):
+    def setUp(self):
+        self.flour = Ingredient.objects.create(
+            name='Flour', unit='g', quantity=5, kanban=True, threshold=10, re_order=20
+        )
+        self.sugar = Ingredient.objects.create(
+            name='Sugar', unit='g', quantity=50, kanban=True, threshold=10, re_order=20
+        )
+        self.salt = Ingredient.objects.create(
+            name='Salt', unit='g', quantity=1, kanban=False, threshold=10, re_order=20
+        )
+        Basket.objects.add(self.flour, 3)
+        Basket.objects.add(self.salt, 4)
+
+    def test_annotations(self):
+        ingredients = Ingredient.objects.with_shopping().in_bulk()
+        flour = ingredients[self.flour.pk]
+        self.assertEqual(
+            (flour.basket_quantity, flour.shortfall, flour.to_buy), (3, 5, 17)
+        )
+        sugar = ingredients[self.sugar.pk]
+        self.assertEqual(
+            (sugar.basket_quantity, sugar.shortfall, sugar.to_buy), (0, 0, 0)
+        )
+        # below threshold but not reordered
+        salt = ingredients[self.salt.pk]
+        self.assertEqual(
+            (salt.basket_quantity, salt.shortfall, salt.to_buy), (4, 9, 0)
+        )
+
+    def test_annotations_match_the_model_methods(self):
+        for ingredient in Ingredient.objects.with_shopping():
+            fresh = Ingredient.objects.get(pk=ingredient.pk)
+            self.assertEqual(ingredient.buy(), fresh.buy())
+            self.assertEqual(ingredient.in_basket(), fresh.in_basket())
+
+    def test_shopping_list(self):
+        self.assertEqual(list(Ingredient.objects.shopping_list()), [self.flour])
+        # nothing left to buy once the reorder quantity is in the basket
+        Basket.objects.add(self.flour, 17)
+        self.assertFalse(Ingredient.objects.shopping_list().exists())
+
+
+class DishCostTests(TestCase):
+    def setUp(self):
+        generate(ingredients=10, dishes=3, recipe_lines=2)
+        self.dish = MenuItem.objects.first()
+        self.ingredient = Ingredient.objects.create(
+            name='Saffron', unit='g', unit_price=Decimal('2.500')
+        )
+
+    def cost(self):
+        return MenuItem.objects.get(pk=self.dish.pk).cost
+
+    def test_recipe_lines_update_the_cost(self):
+        before = self.cost()
+        line = Recipe.objects.create(
+            menu_item=self.dish, ingredient=self.ingredient, quantity=2
+        )
+        self.assertEqual(self.cost(), before + 5)
+        line.quantity = 4
+        line.save()
+        self.assertEqual(self.cost(), before + 10)
+        line.delete()
+        self.assertEqual(self.cost(), before)
+
+    def test_unit_price_changes_update_the_cost(self):
+        Recipe.objects.create(menu_item=self.dish, ingredient=self.ingredient, quantity=2)
+        before = self.cost()
+        self.ingredient.unit_price = Decimal('5.000')
+        self.ingredient.save()
+        self.assertEqual(self.cost(), before + 5)
+
+    # a dish loaded before the price changed doesn't save its old cost back
+    def test_saving_a_loaded_dish_keeps_the_cost(self):
+        Recipe.objects.create(menu_item=self.dish, ingredient=self.ingredient, quantity=2)
+        dish = MenuItem.objects.get(pk=self.dish.pk)
+        self.ingredient.unit_price = Decimal('5.000')
+        self.ingredient.save()
+        expected = self.cost()
+        dish.description = 'With saffron'
+        dish.save()
+        self.assertEqual(self.cost(), expected)
+        self.assertEqual(MenuItem.objects.get(pk=dish.pk).description, 'With saffron')
+
+    def test_rebuild_command_checks_and_fixes_drift(self):
+        out = io.StringIO()
+        call_command('rebuild_dish_costs', '--check', stdout=out)
+        self.assertIn('up to date', out.getvalue())
+        MenuItem.objects.filter(pk=self.dish.pk).update(cost=0)
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '1 dish cost(s) out of date'):
+            call_command('rebuild_dish_costs', '--check', stdout=out)
+        self.assertIn(self.dish.title, out.getvalue())
+        call_command('rebuild_dish_costs', stdout=io.StringIO())
+        call_command('rebuild_dish_costs', '--check', stdout=io.StringIO())
+
+
+# dishes with known prices and costs sold on tables 1 and 2
+# in January and February 2022
+def make_sales():
+    category = Category.objects.create(category='Mains')
+    dishes = {}
+    for title, price, unit_price, quantity in [
+        ('Pie', '10.00', '2.000', 1),
+        ('Soup', '4.50', '0.500', 3),
+        ('Bread', '1.00', '0.100', 1),
+    ]:
+        dish = MenuItem.objects.create(title=title, price=Decimal(price), category=category)
+        ingredient = Ingredient.objects.create(
+            name=f'{title} mix', unit='g', quantity=100, unit_price=Decimal(unit_price)
+        )
+        Recipe.objects.create(menu_item=dish, ingredient=ingredient, quantity=quantity)
+        dishes[title] = dish
+    for table_num, day, sold in [
+        (1, datetime(2022, 1, 10, 12), {'Pie': 2, 'Soup': 1}),
+        (2, datetime(2022, 2, 10, 12), {'Pie': 1, 'Bread': 5}),
+    ]:
+        table_order = TableOrder.objects.create(
+            table=Table.objects.create(table_num=table_num),
+            timestamp=timezone.make_aware(day),
+        )
+        for title, quantity in sold.items():
+            Purchase.objects.create(
+                table_order=table_order, menu_item=dishes[title], quantity=quantity
+            )
+    return dishes
+
+
+class SalesReportTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('manager', is_staff=True))
+        make_sales()
+
+    def totals(self, **period):
+        totals = Purchase.objects.for_period(**period).sales_totals()
+        return totals['revenue'], totals['cost'], totals['profit']
+
+    def test_totals(self):
+        self.assertEqual(
+            self.totals(), (Decimal('39.50'), Decimal('8.00'), Decimal('31.50'))
+        )
+
+    def test_filtered_by_date_and_table(self):
+        january = dict(
+            since=timezone.make_aware(datetime(2022, 1, 1)),
+            until=timezone.make_aware(datetime(2022, 2, 1)),
+        )
+        self.assertEqual(
+            self.totals(**january), (Decimal('24.50'), Decimal('5.50'), Decimal('19.00'))
+        )
+        self.assertEqual(
+            self.totals(table=2), (Decimal('15.00'), Decimal('2.50'), Decimal('12.50'))
+        )
+        self.assertEqual(
+            self.totals(table=2, **january), (Decimal('0.00'),) * 3
+        )
+
+    def test_report_view_filters(self):
+        response = self.client.get(
+            reverse('report'), {'start': '2022-02-01', 'end': '2022-02-10'}
+        )
+        self.assertEqual(response.context['revenue'], Decimal('15.00'))
+        self.assertEqual(response.context['orders'], Decimal('2.50'))
+        self.assertEqual(response.context['profit'], Decimal('12.50'))
+        response = self.client.get(reverse('report'), {'table': 1})
+        self.assertEqual(response.context['revenue'], Decimal('24.50'))
+
+
+class BestSellerTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('manager', is_staff=True))
+        self.dishes = make_sales()
+
+    def ranking(self, by, limit=10, **period):
+        purchases = Purchase.objects.for_period(**period)
+        return [
+            (row['menu_item_name'], row['total_quantity'], row['total_revenue'])
+            for row in purchases.best_sellers(by, limit)
+        ]
+
+    def test_ranked_by_quantity_and_revenue(self):
+        self.assertEqual(self.ranking('quantity'), [
+            ('Bread', 5, Decimal('5.00')),
+            ('Pie', 3, Decimal('30.00')),
+            ('Soup', 1, Decimal('4.50')),
+        ])
+        self.assertEqual(
+            [row[0] for row in self.ranking('revenue')], ['Pie', 'Bread', 'Soup']
+        )
+
+    def test_top_n_and_filters(self):
+        self.assertEqual([row[0] for row in self.ranking('quantity', 2)], ['Bread', 'Pie'])
+        self.assertEqual(self.ranking('quantity', table=1), [
+            ('Pie', 2, Decimal('20.00')), ('Soup', 1, Decimal('4.50')),
+        ])
+
+    # sales of a deleted dish still count, but its price is gone
+    def test_deleted_dish_keeps_its_sales(self):
+        self.dishes['Pie'].delete()
+        self.assertEqual(self.ranking('quantity', 2), [
+            ('Bread', 5, Decimal('5.00')), ('Pie', 3, Decimal('0.00')),
+        ])
+        self.assertEqual(
+            [row[0] for row in self.ranking('revenue')], ['Bread', 'Soup', 'Pie']
+        )
+
+    def test_view(self):
+        response = self.client.get(reverse('best_sellers'), {'top': 1})
+        self.assertEqual(
+            [row['menu_item_name'] for row in response.context['by_quantity']], ['Bread']
+        )
+        self.assertEqual(
+            [row['menu_item_name'] for row in response.context['by_revenue']], ['Pie']
+        )
+
+
+class PurchaseStockTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=3, recipe_lines=2, table_orders=0,
+                purchases=0, basket=0, orders=0)
+
+    def setUp(self):
+        super().setUp()
+        self.dish = MenuItem.objects.first()
+        self.table_order = TableOrder.objects.create(table=Table.objects.first())
+
+    def stock(self):
+        return dict(Ingredient.objects.values_list('pk', 'quantity'))
+
+    def order(self, quantity):
+        return self.client.post(
+            reverse('create_purchases', args=[self.table_order.pk]),
+            {'menu_item': self.dish.pk, 'quantity': quantity},
+        )
+
+    def test_overselling_leaves_stock_unchanged(self):
+        before = self.stock()
+        self.assertFalse(self.dish.adjust_stock(-(self.dish.available() + 1)))
+        self.assertEqual(self.stock(), before)
+
+    def test_not_enough_stock_saves_no_purchase(self):
+        before = self.stock()
+        response = self.order(self.dish.available() + 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response, 'form', 'quantity',
+            f'Only {self.dish.available()} of these are available',
+        )
+        # stock taken by another order after the form was checked
+        with mock.patch.object(MenuItem, 'adjust_stock', return_value=False):
+            response = self.order(1)
+        self.assertFormError(response, 'form', 'quantity', 'Not enough stock for this order')
+        self.assertFalse(Purchase.objects.exists())
+        self.assertEqual(self.stock(), before)
+
+    def test_stock_and_purchase_roll_back_together(self):
+        before = self.stock()
+        with mock.patch.object(Purchase, 'save', side_effect=DatabaseError):
+            response = self.order(1)
+        self.assertFormError(response, 'form', None, STOCK_UNAVAILABLE)
+        self.assertFalse(Purchase.objects.exists())
+        self.assertEqual(self.stock(), before)
+        self.assertRedirects(
+            self.order(1), reverse('purchases', args=[self.table_order.pk])
+        )
+        self.assertEqual(Purchase.objects.get().quantity, 1)
+        self.assertNotEqual(self.stock(), before)
+
+    def test_update_is_limited_to_this_dishes_stock(self):
+        self.order(1)
+        purchase = Purchase.objects.get()
+        url = reverse('update_purchases', args=[self.table_order.pk, purchase.pk])
+        available = self.dish.available()
+        response = self.client.post(url, {'quantity': available + 2})
+        self.assertFormError(
+            response, 'form', 'quantity', f'Current order 1 and {available} more available'
+        )
+        self.client.post(url, {'quantity': available + 1})
+        self.assertEqual(Purchase.objects.get().quantity, available + 1)
+        self.assertEqual(self.dish.available(), 0)
+
+    def test_database_error_is_not_short_stock(self):
+        with mock.patch.object(StockMovement.objects, 'record', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.dish.adjust_stock(-1)
+
+
+class BasketFlushTests(TestCase):
+    def setUp(self):
+        for n in range(10):
+            Ingredient.objects.create(name=f'Ingredient {n}', unit='g', quantity=n)
+
+    def fill_basket(self, size):
+        for n, ingredient in enumerate(Ingredient.objects.all()[:size], start=1):
+            Basket.objects.add(ingredient, n)
+
+    def test_flush_delivers_the_basket(self):
+        self.fill_basket(3)
+        before = dict(Ingredient.objects.values_list('name', 'quantity'))
+        basket = dict(Basket.objects.values_list('ingredient__name', 'quantity'))
+        order_number = OrderNumber.objects.create()
+        self.assertEqual(
+            dict(order_number.order_set.values_list('ingredient_name', 'quantity')),
+            basket,
+        )
+        after = dict(Ingredient.objects.values_list('name', 'quantity'))
+        self.assertEqual(
+            after, {name: quantity + basket.get(name, 0) for name, quantity in before.items()}
+        )
+        self.assertFalse(Basket.objects.exists())
+
+    def test_queries_do_not_depend_on_basket_size(self):
+        self.fill_basket(2)
+        with CaptureQueriesContext(connection) as small:
+            OrderNumber.objects.create()
+        self.fill_basket(10)
+        with CaptureQueriesContext(connection) as large:
+            OrderNumber.objects.create()
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Order.objects.count(), 12)
+
+    def test_empty_basket(self):
+        order_number = OrderNumber.objects.create()
+        self.assertFalse(order_number.order_set.exists())
+
+
+class KanbanTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(category='Mains')
+        self.dish = MenuItem.objects.create(
+            title='Pie', price=Decimal('10.00'), category=category, stock_item=False
+        )
+        other = MenuItem.objects.create(
+            title='Soup', price=Decimal('4.50'), category=category
+        )
+        self.pastry = Ingredient.objects.create(name='Pastry', unit='g', quantity=10)
+        self.salt = Ingredient.objects.create(name='Salt', unit='g', quantity=10)
+        Recipe.objects.create(menu_item=self.dish, ingredient=self.pastry, quantity=1)
+        Recipe.objects.create(menu_item=self.dish, ingredient=self.salt, quantity=1)
+        Recipe.objects.create(menu_item=other, ingredient=self.salt, quantity=1)
+
+    def kanban(self):
+        return dict(Ingredient.objects.values_list('name', 'kanban'))
+
+    def test_flags_follow_stock_item(self):
+        self.assertEqual(self.kanban(), {'Pastry': False, 'Salt': False})
+        self.dish.stock_item = True
+        self.dish.save()
+        self.assertEqual(self.kanban(), {'Pastry': True, 'Salt': True})
+        dish = MenuItem.objects.get(pk=self.dish.pk)
+        dish.stock_item = False
+        dish.save()
+        # salt is also in another recipe so is still reordered
+        self.assertEqual(self.kanban(), {'Pastry': False, 'Salt': True})
+
+    def test_no_ingredient_update_when_stock_item_is_unchanged(self):
+        dish = MenuItem.objects.get(pk=self.dish.pk)
+        dish.price = Decimal('11.00')
+        with CaptureQueriesContext(connection) as queries:
+            dish.save()
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith('UPDATE "inventory_ingredient"')
+        ])
+
+
+# every url in inventory/urls.py with a function returning its reverse() args
+VIEWS = [
+    ('home', lambda: []),
+    ('login', lambda: []),
+    ('signup', lambda: []),
+    ('menu', lambda: []),
+    ('menu_edit', lambda: []),
+    ('create_menu', lambda: []),
+    ('details', lambda: [MenuItem.objects.first().title]),
+    ('menu_item_edit', lambda: [MenuItem.objects.first().title]),
+    ('delete_menu', lambda: [MenuItem.objects.first().title]),
+    ('create_recipe', lambda: [MenuItem.objects.first().title]),
+    ('update_description', lambda: [MenuItem.objects.first().title]),
+    ('table_order', lambda: []),
+    ('create_table_order', lambda: []),
+    ('delete_table_order', lambda: [TableOrder.objects.first().pk]),
+    ('purchases', lambda: [TableOrder.objects.first().pk]),
+    ('create_purchases', lambda: [TableOrder.objects.first().pk]),
+    ('update_purchases', lambda: purchase_args()),
+    ('delete_purchases', lambda: purchase_args()),
+    ('sales_profit', lambda: []),
+    ('report', lambda: []),
+    ('best_sellers', lambda: []),
+    ('export', lambda: ['purchases', 'csv']),
+    ('stock', lambda: []),
+    ('current_stock', lambda: []),
+    ('update_stock', lambda: []),
+    ('stock_take', lambda: []),
+    ('waste', lambda: []),
+    ('stocked_recipes', lambda: []),
+    ('shopping_list', lambda: []),
+    ('add_to_basket', lambda: [Ingredient.objects.first().name]),
+    ('update_basket', lambda: [Basket.objects.first().ingredient.name]),
+    ('basket_view', lambda: []),
+    ('add_any', lambda: []),
+    ('edit_basket', lambda: []),
+    ('ingredients', lambda: []),
+    ('create_ingredients', lambda: []),
+    ('update_ingredients', lambda: [Ingredient.objects.first().name]),
+    ('delete_ingredients', lambda: [Ingredient.objects.first().name]),
+    ('orphans', lambda: []),
+    ('orders', lambda: []),
+    ('create_order', lambda: []),
+    ('logout', lambda: []),
+]
+
+
+def purchase_args():
+    purchase = Purchase.objects.order_by('pk').first()
+    return [purchase.table_order_id, purchase.pk]
+
+
+# Query count, wall time and peak memory of every view on a small dataset
+# and again after the data has grown; a view fails if its query count grows
+# set INVENTORY_BENCHMARK_JSON to a file path to save the results as JSON
+class ViewQueryCountTests(TestCase):
+    SMALL = dict(
+        ingredients=20, dishes=10, recipe_lines=3, table_orders=10,
+        purchases=30, basket=5, orders=2
+    )
+    LARGE = dict(
+        ingredients=100, dishes=50, recipe_lines=5, table_orders=100,
+        purchases=500, basket=30, orders=10
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'benchmark', password='benchmark', is_staff=True
+        )
+
+    def measure(self, name, args):
+        self.client.force_login(self.user)
+        url = reverse(name, args=args)
+        tracemalloc.start()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertLess(response.status_code, 400, url)
+        return {
+            'url': url,
+            'status': response.status_code,
+            'queries': len(queries),
+            'time_ms': round(elapsed * 1000, 3),
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    def measure_all(self):
+        return {name: self.measure(name, args()) for name, args in VIEWS}
+
+    def test_query_counts_do_not_grow_with_data(self):
+        small_sizes = generate(prefix='small-', **self.SMALL)
+        small = self.measure_all()
+        large_sizes = generate(prefix='large-', seed=1, **self.LARGE)
+        large = self.measure_all()
+
+        self.write_results({
+            'timestamp': timezone.now().isoformat(),
+            'sizes': {'small': small_sizes, 'large': large_sizes},
+            'views': {
+                name: {'small': small[name], 'large': large[name]}
+                for name, args in VIEWS
+            },
+        })
+
+        for name, args in VIEWS:
+            with self.subTest(view=name):
+                self.assertEqual(
+                    large[name]['queries'], small[name]['queries'],
+                    f'{name} query count grows with data size'
+                )
+
+    def write_results(self, results):
+        path = os.environ.get('INVENTORY_BENCHMARK_JSON')
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+
+class OrphanIngredientTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('manager', is_staff=True))
+        category = Category.objects.create(category='Mains')
+        stocked = MenuItem.objects.create(
+            title='Pie', price=Decimal('10.00'), category=category
+        )
+        unstocked = MenuItem.objects.create(
+            title='Special', price=Decimal('12.00'), category=category, stock_item=False
+        )
+        other = MenuItem.objects.create(
+            title='Soup', price=Decimal('4.50'), category=category, stock_item=False
+        )
+        ingredients = {
+            name: Ingredient.objects.create(name=name, unit='g', quantity=10)
+            for name in ('Pastry', 'Saffron', 'Salt', 'Truffle')
+        }
+        Recipe.objects.create(menu_item=stocked, ingredient=ingredients['Pastry'], quantity=1)
+        Recipe.objects.create(menu_item=unstocked, ingredient=ingredients['Saffron'], quantity=1)
+        Recipe.objects.create(menu_item=unstocked, ingredient=ingredients['Salt'], quantity=1)
+        Recipe.objects.create(menu_item=other, ingredient=ingredients['Salt'], quantity=1)
+
+    def test_lists(self):
+        response = self.client.get(reverse('orphans'))
+        self.assertEqual(
+            [ingredient.name for ingredient in response.context['object_list']],
+            ['Saffron'],
+        )
+        self.assertEqual(
+            [ingredient.name for ingredient in response.context['no_recipe']],
+            ['Truffle'],
+        )
+
+    def test_annotations_match_the_model_methods(self):
+        for ingredient in Ingredient.objects.with_recipe_counts():
+            fresh = Ingredient.objects.get(pk=ingredient.pk)
+            self.assertEqual(ingredient.no_recipe(), fresh.no_recipe())
+            self.assertEqual(ingredient.non_stock(), fresh.non_stock())
+
+
+@override_settings(INVENTORY_PROFILER=True)
+class QueryProfilerTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=5, recipe_lines=2, orders=3)
+
+    def setUp(self):
+        super().setUp()
+        stats.reset()
+
+    def test_records_queries_and_server_timing(self):
+        response = self.client.get(reverse('orders'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+        report = self.client.get(reverse('profiler')).json()
+        orders = [row for row in report['views'] if row['view'] == 'orders']
+        self.assertEqual(orders[0]['requests'], 1)
+
+    def test_repeated_queries_share_a_fingerprint(self):
+        with QueryProfile() as profile:
+            for ingredient in Ingredient.objects.all()[:3]:
+                Ingredient.objects.filter(pk__in=[ingredient.pk] * ingredient.pk).count()
+        self.assertEqual(list(profile.duplicates().values()), [3])
+
+    def test_report_is_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('profiler'))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(INVENTORY_PROFILER=False)
+    def test_profile_views_command(self):
+        out = io.StringIO()
+        call_command(
+            'profile_views', reverse('orders'), '--user', 'manager', '--repeat', '2',
+            stdout=out,
+        )
+        row, = stats.report()
+        self.assertEqual((row['view'], row['requests']), ('orders', 2))
+        self.assertGreater(row['avg_render_ms'], 0)
+        self.assertIn('ms rendering', out.getvalue())
+
+
+class InventoryCacheTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=5, recipe_lines=2)
+
+    def test_menu_is_cached_until_stock_changes(self):
+        menu_item = MenuItem.objects.filter(display=True).first()
+        Ingredient.objects.update(quantity=0)
+
+        with CaptureQueriesContext(connection) as first:
+            stale = self.client.get(reverse('menu')).content
+        with CaptureQueriesContext(connection) as second:
+            self.client.get(reverse('menu'))
+        self.assertLess(len(second), len(first))
+
+        menu_item.adjust_stock(1)
+        fresh = self.client.get(reverse('menu')).content
+        self.assertNotEqual(fresh, stale)
+
+
+class BasketAddTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=2, recipe_lines=2, basket=0)
+
+    def setUp(self):
+        super().setUp()
+        self.ingredient = Ingredient.objects.first()
+
+    def test_add_creates_then_increments_the_line(self):
+        Basket.objects.add(self.ingredient, 3)
+        line = Basket.objects.add(self.ingredient, 4)
+        self.assertEqual(line.quantity, 7)
+        self.assertEqual(Basket.objects.get().quantity, 7)
+
+    def test_add_without_upsert_support(self):
+        with mock.patch('inventory.models._upsert_features',
+                        return_value=(False, False)):
+            Basket.objects.add(self.ingredient, 3)
+            line = Basket.objects.add(self.ingredient, 4)
+        self.assertEqual(line.quantity, 7)
+        self.assertEqual(Basket.objects.count(), 1)
+
+    def test_change_quantity_below_zero_fails(self):
+        line = Basket.objects.add(self.ingredient, 3)
+        self.assertFalse(line.change_quantity(-5))
+        self.assertTrue(line.change_quantity(-1))
+        self.assertEqual(line.quantity, 2)
+        self.assertEqual(Basket.objects.get().quantity, 2)
+
+    def test_update_view_refuses_a_change_below_zero(self):
+        Basket.objects.add(self.ingredient, 3)
+        url = reverse('update_basket', args=[self.ingredient.name])
+        response = self.client.post(url, {'quantity': -100})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', 'quantity',
+                             'Not enough in the basket to take away')
+        self.assertEqual(Basket.objects.get().quantity, 3)
+
+    def test_add_view_queries_do_not_depend_on_basket_size(self):
+        url = reverse('add_any')
+        data = {'ingredient': self.ingredient.pk, 'quantity': 5}
+        self.client.post(url, data)
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(url, data)
+        for ingredient in Ingredient.objects.exclude(pk=self.ingredient.pk):
+            Basket.objects.add(ingredient, 1)
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(url, data)
+        self.assertEqual(len(large), len(small))
+        line = Basket.objects.get(ingredient=self.ingredient)
+        self.assertEqual(line.quantity, 15)
+
+    def test_restock_views_add_to_the_line(self):
+        name = self.ingredient.name
+        self.client.post(reverse('add_to_basket', args=[name]), {'quantity': 2})
+        self.client.post(reverse('add_to_basket', args=[name]), {'quantity': 3})
+        self.client.post(reverse('update_basket', args=[name]), {'quantity': 4})
+        self.assertEqual(Basket.objects.get().quantity, 9)
+
+    # two requests holding the same stale line both keep their change
+    def test_stale_lines_do_not_lose_updates(self):
+        Basket.objects.add(self.ingredient, 1)
+        first = Basket.objects.get()
+        second = Basket.objects.get()
+        first.change_quantity(2)
+        second.change_quantity(3)
+        self.assertEqual(second.quantity, 6)
+        self.assertEqual(Basket.objects.get().quantity, 6)
+
+
+class KeysetPaginationTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=5, recipe_lines=2, table_orders=120,
+                purchases=120, orders=30)
+
+    # follows next (or previous) links from url, returning each page
+    # with the number of queries it took
+    def walk(self, url, link='next_url'):
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            page = response.context['page_obj']
+            pages.append((page, len(queries)))
+            url = getattr(page, link)
+            url = url and reverse('table_order') + url
+        return pages
+
+    def test_pages_cover_every_table_order_in_order(self):
+        pages = self.walk(reverse('table_order'))
+        rows = [obj.pk for page, count in pages for obj in page]
+        expected = TableOrder.objects.order_by('-timestamp', '-id')
+        self.assertEqual(rows, list(expected.values_list('pk', flat=True)))
+        self.assertEqual(len(pages), 3)
+        # the last page costs the same as the first
+        self.assertEqual(pages[-1][1], pages[0][1])
+
+    def test_previous_links_walk_back(self):
+        forward = [page for page, count in self.walk(reverse('table_order'))]
+        url = reverse('table_order') + forward[-1].previous_url
+        backward = [page for page, count in self.walk(url, 'previous_url')]
+        self.assertEqual(
+            [page.object_list for page in backward],
+            [page.object_list for page in forward[-2::-1]],
+        )
+
+    def test_filters_are_kept_in_page_links(self):
+        week_ago = timezone.now() - timezone.timedelta(days=7)
+        response = self.client.get(reverse('table_order'), {'window': 'week'})
+        for table_order in response.context['object_list']:
+            self.assertGreaterEqual(table_order.timestamp, week_ago)
+
+        start = (timezone.localdate() - timezone.timedelta(days=400)).isoformat()
+        response = self.client.get(reverse('table_order'), {'start': start})
+        next_url = response.context['page_obj'].next_url
+        self.assertIn(f'start={start}', next_url)
+        self.assertIn('after=', next_url)
+
+    def test_orders_are_paged_by_order_number(self):
+        response = self.client.get(reverse('orders'))
+        page = response.context['page_obj']
+        self.assertEqual(len(page), 100)
+        numbers = [order.order_number_id for order in page]
+        self.assertEqual(numbers, sorted(numbers, reverse=True))
+        following = self.client.get(reverse('orders') + page.next_url)
+        self.assertEqual(
+            len(following.context['page_obj']), Order.objects.count() - 100
+        )
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('table_order'), {'after': 'nonsense'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=5, recipe_lines=2, table_orders=40,
+                purchases=80, orders=4)
+
+    def export(self, name, format, **params):
+        response = self.client.get(reverse('export', args=[name, format]), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_purchases_csv_has_every_row_with_price_and_cost(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('purchases', 'csv'))))
+        self.assertEqual(len(rows), Purchase.objects.count())
+        purchase = Purchase.objects.select_related('menu_item', 'table_order').get(
+            pk=rows[0]['id']
+        )
+        self.assertEqual(rows[0]['dish'], purchase.menu_item_name)
+        self.assertEqual(rows[0]['price'], str(purchase.menu_item.price))
+        self.assertEqual(rows[0]['cost'], str(purchase.menu_item.cost))
+
+    def test_export_resumes_after_an_id(self):
+        lines = self.export('orders', 'ndjson').splitlines()
+        middle = json.loads(lines[9])['id']
+        resumed = self.export('orders', 'ndjson', after=middle).splitlines()
+        self.assertEqual(resumed, lines[10:])
+
+    def test_date_range_filters_purchases(self):
+        week_ago = timezone.now() - timezone.timedelta(days=7)
+        text = self.export('purchases', 'csv', window='week')
+        rows = list(csv.DictReader(io.StringIO(text)))
+        expected = Purchase.objects.filter(table_order__timestamp__gte=week_ago)
+        self.assertEqual(len(rows), expected.count())
+
+    def test_stock_ndjson(self):
+        lines = self.export('stock', 'ndjson').splitlines()
+        first = json.loads(lines[0])
+        ingredient = Ingredient.objects.order_by('pk').first()
+        self.assertEqual(first['ingredient'], ingredient.name)
+        self.assertEqual(len(lines), Ingredient.objects.count())
+
+    def test_unknown_export_and_bad_filters(self):
+        response = self.client.get(reverse('export', args=['users', 'csv']))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse('export', args=['purchases', 'csv']), {'after': 'x'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_management_command_matches_the_endpoint(self):
+        out = io.StringIO()
+        call_command('export_data', 'purchases', '--format', 'csv', stdout=out)
+        self.assertEqual(out.getvalue(), self.export('purchases', 'csv'))
+
+
+class StockTakeTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=30, dishes=2, recipe_lines=2)
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('stock_take')
+
+    def upload(self, rows, **data):
+        lines = ['ingredient,quantity'] + [f'{name},{qty}' for name, qty in rows]
+        upload = SimpleUploadedFile('count.csv', '\n'.join(lines).encode())
+        return self.client.post(self.url, {'file': upload, **data})
+
+    def counted(self, ingredients, offset=1):
+        return [(obj.name, obj.quantity + offset) for obj in ingredients]
+
+    def test_upload_shows_diff_without_changing_stock(self):
+        ingredients = list(Ingredient.objects.order_by('pk')[:5])
+        response = self.upload(self.counted(ingredients))
+        diff = response.context['diff']
+        self.assertEqual(len(diff.changes), 5)
+        self.assertTrue(diff.is_valid())
+        self.assertEqual(
+            Ingredient.objects.get(pk=ingredients[0].pk).quantity,
+            ingredients[0].quantity,
+        )
+
+    # the stock export can be uploaded as it is, blank quantities included
+    def test_upload_the_stock_export(self):
+        Ingredient.objects.filter(pk=Ingredient.objects.first().pk).update(quantity=None)
+        export = self.client.get(reverse('export', args=['stock', 'csv']))
+        upload = SimpleUploadedFile('stock.csv', b''.join(export.streaming_content))
+        diff = self.client.post(self.url, {'file': upload}).context['diff']
+        self.assertTrue(diff.is_valid(), diff.as_dict())
+        self.assertEqual(diff.changes, [])
+        self.assertEqual(diff.unchanged, Ingredient.objects.count())
+
+    def test_apply_updates_stock_and_records_adjustments(self):
+        ingredients = list(Ingredient.objects.order_by('pk')[:5])
+        rows = self.counted(ingredients)
+        response = self.client.post(
+            self.url, {'rows': json.dumps(dict(rows)), 'apply': 'Apply'}
+        )
+        self.assertRedirects(response, reverse('current_stock'))
+        for obj in ingredients:
+            self.assertEqual(
+                Ingredient.objects.get(pk=obj.pk).quantity, obj.quantity + 1
+            )
+        adjustments = StockAdjustment.objects.select_related('stock_take')
+        self.assertEqual(adjustments.count(), 5)
+        self.assertEqual(adjustments.first().stock_take.user, self.user)
+
+    def test_apply_query_count_does_not_grow_with_rows(self):
+        ingredients = list(Ingredient.objects.order_by('pk'))
+
+        def apply(rows):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, {'rows': json.dumps(dict(rows)), 'apply': 'Apply'})
+            return len(queries)
+
+        self.assertEqual(
+            apply(self.counted(ingredients[:3])),
+            apply(self.counted(ingredients, offset=2)),
+        )
+
+    def test_unknown_and_invalid_rows_block_apply(self):
+        ingredient = Ingredient.objects.first()
+        response = self.upload(
+            [(ingredient.name, 'lots'), ('no such thing', 1)], apply='Apply'
+        )
+        diff = response.context['diff']
+        self.assertEqual(diff.unknown, ['no such thing'])
+        self.assertEqual(diff.invalid[0][1], ingredient.name)
+        self.assertFalse(StockAdjustment.objects.exists())
+
+    def test_json_body(self):
+        ingredient = Ingredient.objects.first()
+        body = {'rows': {ingredient.name: 7}, 'apply': True}
+        response = self.client.post(
+            self.url, json.dumps(body), content_type='application/json'
+        )
+        self.assertEqual(response.json()['changes'][0]['new'], 7)
+        self.assertEqual(Ingredient.objects.get(pk=ingredient.pk).quantity, 7)
+
+    def test_stock_formset_is_recorded(self):
+        Ingredient.objects.update(quantity=10)
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        data = {
+            'form-TOTAL_FORMS': len(ingredients),
+            'form-INITIAL_FORMS': len(ingredients),
+        }
+        for i, obj in enumerate(ingredients):
+            data[f'form-{i}-id'] = obj.pk
+            data[f'form-{i}-quantity'] = 12 if i == 0 else 10
+        self.client.post(reverse('update_stock'), data)
+        adjustment = StockAdjustment.objects.get()
+        self.assertEqual(
+            (adjustment.old_quantity, adjustment.new_quantity), (10, 12)
+        )
+
+
+class StockLedgerTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=3, recipe_lines=2, basket=3)
+
+    def setUp(self):
+        super().setUp()
+        Ingredient.objects.update(quantity=1000)
+        StockMovement.objects.all().delete()
+        StockMovement.objects.record(StockMovement.STOCK_TAKE, [
+            (pk, 1000) for pk in Ingredient.objects.values_list('pk', flat=True)
+        ])
+
+    def assertLedgerMatchesStock(self):
+        call_command('stock_ledger', '--check', stdout=io.StringIO())
+
+    def ledger(self, when=None):
+        ingredients = Ingredient.objects.with_stock_at(when)
+        return dict(ingredients.values_list('pk', 'ledger_quantity'))
+
+    def test_every_stock_change_is_recorded(self):
+        MenuItem.objects.first().adjust_stock(-2)
+        OrderNumber.objects.create()
+        ingredient = Ingredient.objects.first()
+        ingredient.waste(5)
+        ingredient.quantity = 700
+        ingredient.save()
+        self.client.post(
+            reverse('stock_take'),
+            json.dumps({'rows': {ingredient.name: 650}, 'apply': True}),
+            content_type='application/json',
+        )
+        self.assertLedgerMatchesStock()
+        kinds = set(StockMovement.objects.values_list('kind', flat=True))
+        self.assertEqual(kinds, {'purchase', 'delivery', 'waste', 'stock_take'})
+
+    def test_stock_at_a_point_in_time(self):
+        before = self.ledger()
+        checkpoint = timezone.now()
+        MenuItem.objects.first().adjust_stock(-1)
+        self.assertEqual(self.ledger(checkpoint), before)
+        self.assertNotEqual(self.ledger(), before)
+
+    def test_snapshots_fold_the_tail(self):
+        MenuItem.objects.first().adjust_stock(-1)
+        checkpoint = timezone.now()
+        at_checkpoint = self.ledger(checkpoint)
+        taken = StockSnapshot.objects.take(lag=timezone.timedelta(0))
+        self.assertEqual(taken, Ingredient.objects.count())
+        MenuItem.objects.last().adjust_stock(-1)
+        self.assertLedgerMatchesStock()
+        self.assertEqual(self.ledger(checkpoint), at_checkpoint)
+        # only the two ingredients of the last dish moved since
+        self.assertEqual(StockSnapshot.objects.take(lag=timezone.timedelta(-1)), 2)
+        self.assertEqual(StockSnapshot.objects.take(lag=timezone.timedelta(-1)), 0)
+
+    def test_waste_view(self):
+        ingredient = Ingredient.objects.first()
+        self.client.post(reverse('waste'), {'ingredient': ingredient.pk, 'quantity': 1001})
+        self.assertEqual(Ingredient.objects.get(pk=ingredient.pk).quantity, 1000)
+        self.client.post(reverse('waste'), {'ingredient': ingredient.pk, 'quantity': 10})
+        self.assertEqual(Ingredient.objects.get(pk=ingredient.pk).quantity, 990)
+        self.assertLedgerMatchesStock()
+
+    def stock(self):
+        return dict(Ingredient.objects.values_list('pk', 'quantity'))
+
+    @override_settings(INVENTORY_APPEND_STOCK=True)
+    def test_appending_writers_refresh_stock_on_commit(self):
+        before = self.stock()
+        with self.captureOnCommitCallbacks() as callbacks, \
+                CaptureQueriesContext(connection) as queries:
+            self.assertTrue(MenuItem.objects.first().adjust_stock(-2))
+            OrderNumber.objects.create()
+            Ingredient.objects.first().waste(5)
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith('UPDATE "inventory_ingredient"')
+        ])
+        self.assertEqual(self.stock(), before)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.stock(), before)
+        self.assertLedgerMatchesStock()
+
+    # deliveries and waste only append; sales still lock their ingredients
+    @override_settings(INVENTORY_APPEND_STOCK=True)
+    def test_only_appended_sales_lock_ingredient_rows(self):
+        with mock.patch.object(
+            IngredientQuerySet, 'select_for_update', autospec=True,
+            side_effect=QuerySet.select_for_update,
+        ) as lock, self.captureOnCommitCallbacks():
+            OrderNumber.objects.create()
+            Ingredient.objects.first().waste(5)
+            lock.assert_not_called()
+            self.assertTrue(MenuItem.objects.first().adjust_stock(-1))
+            lock.assert_called_once()
+
+    @override_settings(INVENTORY_APPEND_STOCK=True)
+    def test_appended_sales_are_checked_against_the_ledger(self):
+        dish = MenuItem.objects.first()
+        available = dish.available()
+        with self.captureOnCommitCallbacks():
+            self.assertTrue(dish.adjust_stock(-available))
+            # stock isn't refreshed until commit, but the ledger has none left
+            self.assertEqual(MenuItem.objects.get(pk=dish.pk).available(), available)
+            self.assertFalse(dish.adjust_stock(-1))
+
+    # a full save of an ingredient loaded before a sale counts its stock
+    # against the ledger as it is now
+    def test_saving_a_stale_ingredient_keeps_the_ledger(self):
+        dish = MenuItem.objects.filter(recipe__isnull=False).first()
+        ingredient = Ingredient.objects.get(pk=dish.recipe_set.first().ingredient_id)
+        self.assertTrue(dish.adjust_stock(-1))
+        ingredient.name = 'renamed'
+        ingredient.save()
+        self.assertLedgerMatchesStock()
+
+    def test_refresh_sets_stock_from_the_ledger(self):
+        Ingredient.objects.update(quantity=0)
+        call_command('stock_ledger', '--refresh', stdout=io.StringIO())
+        self.assertLedgerMatchesStock()
+        self.assertEqual(set(self.stock().values()), {1000})
+
+    def test_ledger_is_read_only_in_admin(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        movement = StockMovement.objects.first()
+        changelist = reverse('admin:inventory_stockmovement_changelist')
+        self.assertEqual(self.client.get(changelist).status_code, 200)
+        add = reverse('admin:inventory_stockmovement_add')
+        self.assertEqual(self.client.get(add).status_code, 403)
+        change = reverse('admin:inventory_stockmovement_change', args=[movement.pk])
+        self.assertEqual(self.client.post(change, {'quantity': 0}).status_code, 403)
+        delete = reverse('admin:inventory_stockmovement_delete', args=[movement.pk])
+        self.assertEqual(self.client.post(delete, {'post': 'yes'}).status_code, 403)
+        self.assertEqual(StockMovement.objects.get(pk=movement.pk).quantity, 1000)
+
+
+class BillOfMaterialsTests(TestCase):
+    def setUp(self):
+        generate(ingredients=40, dishes=15, recipe_lines=4, table_orders=20,
+                 purchases=60)
+
+    def test_matches_the_database(self):
+        bom = get_bom()
+        availability = MenuItem.objects.with_availability()
+        self.assertEqual(
+            bom.max_servings(), dict(availability.values_list('pk', 'availability'))
+        )
+        self.assertEqual(bom.costs(), dict(MenuItem.objects.values_list('pk', 'cost')))
+
+    def test_answers_without_queries(self):
+        bom = get_bom()
+        dish = MenuItem.objects.first()
+        with self.assertNumQueries(0):
+            bom.max_servings()
+            bom.requirements({dish.pk: 10})
+            bom.unavailable_if({bom.ingredient_ids[0]: -100})
+
+    def test_requirements_and_shortfall(self):
+        recipe = list(Recipe.objects.filter(menu_item=MenuItem.objects.first()))
+        dish = recipe[0].menu_item_id
+        ingredient = recipe[0].ingredient
+        ingredient.quantity = 0
+        ingredient.save()
+        bom = get_bom()
+        needed = bom.requirements({dish: 3})
+        self.assertEqual(
+            needed, {line.ingredient_id: line.quantity * 3 for line in recipe}
+        )
+        self.assertEqual(
+            bom.shortfall({dish: 3}), {recipe[0].ingredient_id: recipe[0].quantity * 3}
+        )
+
+    def test_what_if_an_ingredient_drops(self):
+        bom = get_bom()
+        servings = bom.max_servings()
+        ingredient = Recipe.objects.filter(
+            menu_item__in=[pk for pk, n in servings.items() if n > 0]
+        ).values_list('ingredient', flat=True).first()
+        stock = bom.stock[bom.ingredient_index[ingredient]]
+        lost = bom.unavailable_if({ingredient: -stock})
+        using = Recipe.objects.filter(ingredient=ingredient).values_list(
+            'menu_item', flat=True
+        )
+        expected = sorted(pk for pk in using if servings[pk] > 0)
+        self.assertEqual(lost, expected)
+        self.assertTrue(lost)
+
+    def test_reloaded_after_stock_or_recipe_changes(self):
+        bom = get_bom()
+        self.assertIs(get_bom(), bom)
+        MenuItem.objects.first().adjust_stock(1)
+        self.assertIsNot(get_bom(), bom)
+        bom = get_bom()
+        line = Recipe.objects.first()
+        line.quantity += 1
+        line.save()
+        self.assertIsNot(get_bom(), bom)
+
+    def test_forecast_command(self):
+        out = io.StringIO()
+        call_command('stock_forecast', '--covers', '100', '--days', '400', stdout=out)
+        self.assertIn('Ingredients needed for 100 covers', out.getvalue())
+
+
+class MenuSectionsTests(TestCase):
+    def setUp(self):
+        generate(ingredients=20, dishes=12, recipe_lines=3)
+
+    def test_sections_match_the_dishes(self):
+        with self.assertNumQueries(1):
+            sections = menu_sections()
+        menu = MenuItem.objects.filter(display=True).with_availability()
+        menu = menu.select_related('category').order_by('category_id', 'title')
+        rows = [(section.category, row) for section in sections for row in section.rows]
+        self.assertEqual(len(rows), menu.count())
+        for (category, row), menu_item in zip(rows, menu):
+            self.assertEqual(category, menu_item.category.category)
+            self.assertEqual(row.title, menu_item.title)
+            self.assertEqual(row.profit, menu_item.dish_profit())
+            self.assertEqual(row.available, menu_item.available())
+        categories = [section.category for section in sections]
+        self.assertEqual(len(categories), len(set(categories)))
+
+
+# an EventSource connected to the ASGI application, recording what it is sent
+class SimulatedClient:
+    def __init__(self, cookie=None):
+        self.headers = [(b'cookie', cookie.encode())] if cookie else []
+        self.messages = []
+        self.arrived = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.requested = False
+
+    def connect(self):
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': STREAM_PATH,
+            'query_string': b'', 'headers': self.headers,
+        }
+        return asyncio.ensure_future(application(scope, self.receive, self.send))
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        self.messages.append(message)
+        self.arrived.set()
+
+    def events(self):
+        body = b''.join(m.get('body', b'') for m in self.messages).decode()
+        return [
+            json.loads(block.split('data: ', 1)[1])
+            for block in body.split('\n\n') if block.startswith('event:')
+        ]
+
+    async def wait_for(self, count):
+        while len(self.events()) < count:
+            self.arrived.clear()
+            await asyncio.wait_for(self.arrived.wait(), 5)
+
+
+class LiveFeedTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=20, dishes=10, recipe_lines=3)
+    clients = 200
+
+    def setUp(self):
+        super().setUp()
+        self.cookie = f'sessionid={self.client.cookies["sessionid"].value}'
+        self.dish = MenuItem.objects.with_availability().filter(
+            availability__gt=0
+        ).first()
+
+    # returns the queries the sale and publishing its change took
+    def sell(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(self.dish.adjust_stock(-1))
+        return len(queries)
+
+    def test_changes_fan_out_to_every_client(self):
+        async def scenario():
+            clients = [SimulatedClient(self.cookie) for i in range(self.clients)]
+            tasks = [client.connect() for client in clients]
+            for client in clients:
+                await client.wait_for(1)
+            self.assertEqual(len(broadcaster), self.clients)
+            queries = await sync_to_async(self.sell)()
+            for client in clients:
+                await client.wait_for(2)
+                client.closed.set()
+            await asyncio.gather(*tasks)
+            return clients, queries
+
+        clients, queries = async_to_sync(scenario)()
+        self.assertEqual(len(broadcaster), 0)
+        # the change is worked out once, not once per client
+        self.assertLess(queries, 20)
+        snapshot, change = clients[0].events()
+        self.assertEqual(len(snapshot['dishes']), MenuItem.objects.count())
+        available = snapshot['dishes'][str(self.dish.pk)]['available']
+        self.assertEqual(
+            change['dishes'][str(self.dish.pk)]['available'],
+            MenuItem.objects.with_availability().get(pk=self.dish.pk).availability,
+        )
+        self.assertLessEqual(
+            change['dishes'][str(self.dish.pk)]['available'], available
+        )
+        used = Recipe.objects.filter(menu_item=self.dish)
+        self.assertEqual(
+            {int(pk) for pk in change['stock']},
+            set(used.values_list('ingredient', flat=True)),
+        )
+        for client in clients:
+            self.assertEqual(client.events(), [snapshot, change])
+            self.assertEqual(client.messages[0]['status'], 200)
+
+    def test_needs_login(self):
+        async def scenario():
+            client = SimulatedClient()
+            await client.connect()
+            return client
+
+        client = async_to_sync(scenario)()
+        self.assertEqual(client.messages[0]['status'], 403)
+
+    def test_slow_client_is_resynced(self):
+        queue = asyncio.Queue(2)
+        for i in range(3):
+            _offer(queue, {'dishes': {}, 'stock': {}})
+        self.assertEqual(queue.qsize(), 1)
+        self.assertIs(queue.get_nowait(), RESYNC)
+
+    def test_django_serves_other_paths(self):
+        async def scenario():
+            messages = []
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': reverse('login'),
+                'query_string': b'', 'headers': [], 'server': ('testserver', 80),
+            }
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await application(scope, receive, send)
+            return messages
+
+        self.assertEqual(async_to_sync(scenario)()[0]['status'], 200)
+
+
+# the async views render the same pages as the sync ones
+@override_settings(ROOT_URLCONF='djangodelights.asgi_urls', INVENTORY_ASYNC_THREADS=0)
+class AsyncViewTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=20, dishes=10, recipe_lines=3, table_orders=20,
+                purchases=60)
+
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+
+    def get(self, client, url):
+        async def get():
+            return await client.get(url, secure=True)
+        return async_to_sync(get)()
+
+    def test_same_pages_as_sync_views(self):
+        for name in ASYNC_VIEWS:
+            for query in ['', '?window=week']:
+                url = reverse(name) + query
+                with self.subTest(url=url):
+                    with override_settings(ROOT_URLCONF='djangodelights.urls'):
+                        expected = self.client.get(url, secure=True)
+                    response = self.get(self.async_client, url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.content, expected.content)
+
+    def test_needs_login(self):
+        response = self.get(AsyncClient(), reverse('report'))
+        self.assertEqual(response.status_code, 302)
+
+    # the ASGI entry point picks the async views whatever ROOT_URLCONF says
+    @override_settings(ROOT_URLCONF='djangodelights.urls')
+    def test_served_by_the_asgi_application(self):
+        cookie = f'{settings.SESSION_COOKIE_NAME}='
+        cookie += self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        async def scenario():
+            messages = []
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': reverse('best_sellers'),
+                'query_string': b'top=3', 'server': ('testserver', 80),
+                'headers': [(b'cookie', cookie.encode())],
+            }
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await application(scope, receive, send)
+            return messages
+
+        with mock.patch('inventory.asyncviews.run_queries', wraps=run_queries) as queries:
+            messages = async_to_sync(scenario)()
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertTrue(queries.called)
+        expected = self.client.get(reverse('best_sellers'), {'top': 3})
+        self.assertEqual(messages[1]['body'], expected.content)
+
+    def test_queries_run_side_by_side(self):
+        barrier = threading.Barrier(2, timeout=5)
+        with override_settings(INVENTORY_ASYNC_THREADS=4):
+            results = async_to_sync(run_queries)(barrier.wait, barrier.wait)
+        self.assertEqual(sorted(results), [0, 1])
+
+
+class SqliteProfileTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'profile.sqlite3')
+
+    # a connection of its own to a database file, as in production
+    def connect(self):
+        default = connections['default']
+        wrapper = type(default)({**default.settings_dict, 'NAME': self.path}, 'profile')
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    @override_settings(INVENTORY_SQLITE=settings.SQLITE_PROFILES['production'])
+    def test_production_profile(self):
+        wrapper = self.connect()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 10000)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -64000)
+        # transactions take the write lock as they begin
+        wrapper._start_transaction_under_autocommit()
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+            other.execute('BEGIN IMMEDIATE')
+        wrapper.connection.execute('ROLLBACK')
+
+    @override_settings(INVENTORY_SQLITE=settings.SQLITE_PROFILES['development'])
+    def test_development_profile(self):
+        wrapper = self.connect()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertNotIn('_start_transaction_under_autocommit', wrapper.__dict__)
+
+
+# the 'replica' alias is a second, separate test database here, holding a
+# sale the primary doesn't have, so it shows where each read went
+@override_settings(INVENTORY_REPLICA='replica')
+class ReplicaRoutingTests(InventoryTestMixin, TestCase):
+    DATA = dict(ingredients=10, dishes=5, recipe_lines=2, table_orders=10,
+                purchases=20)
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.using('replica').create(category='Replica')
+        dish = MenuItem.objects.using('replica').create(
+            title='Replica special', price=Decimal('12.50'), category=category
+        )
+        table = Table.objects.using('replica').create(table_num=1)
+        table_order = TableOrder.objects.using('replica').create(table=table)
+        Purchase.objects.using('replica').create(
+            table_order=table_order, menu_item=dish, quantity=2
+        )
+
+    def test_reports_read_from_the_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            report = self.client.get(reverse('report'))
+            best_sellers = self.client.get(reverse('best_sellers'))
+        self.assertEqual(report.context['revenue'], Decimal('25.00'))
+        self.assertContains(best_sellers, 'Replica special')
+        self.assertTrue(replica.captured_queries)
+        # the session and user come from the primary
+        for query in replica.captured_queries:
+            self.assertIn('inventory_', query['sql'])
+
+    def test_exports_stream_from_the_replica(self):
+        response = self.client.get(reverse('export', args=['purchases', 'csv']))
+        rows = list(csv.DictReader(io.StringIO(
+            b''.join(response.streaming_content).decode()
+        )))
+        self.assertEqual([row['dish'] for row in rows], ['Replica special'])
+
+    def test_other_pages_read_from_the_primary(self):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(reverse('table_order'))
+        self.assertEqual(len(response.context['object_list']), 10)
+        self.assertFalse(replica.captured_queries)
+
+    def test_writes_go_to_the_primary(self):
+        router = ReplicaRouter()
+        with reporting():
+            self.assertEqual(router.db_for_read(Purchase), 'replica')
+            self.assertEqual(router.db_for_write(Purchase), 'default')
+            self.assertEqual(router.db_for_write(Basket), 'default')
+            self.assertEqual(router.db_for_write(OrderNumber), 'default')
+            self.assertIsNone(router.db_for_read(User))
+        self.assertIsNone(router.db_for_read(Purchase))
+        with reporting():
+            dish = MenuItem.objects.get(title='Replica special')
+            Purchase.objects.create(
+                table_order=TableOrder.objects.using('default').first(),
+                menu_item=MenuItem.objects.using('default').first(),
+            )
+        self.assertEqual(dish._state.db, 'replica')
+        self.assertEqual(Purchase.objects.using('replica').count(), 1)
+        self.assertEqual(Purchase.objects.count(), 21)
+
+    def test_basket_adds_go_to_the_primary(self):
+        ingredient = Ingredient.objects.first()
+        Basket.objects.filter(ingredient=ingredient).delete()
+        with reporting():
+            Basket.objects.add(ingredient, 3)
+            with mock.patch('inventory.models._upsert_features',
+                            return_value=(False, False)):
+                line = Basket.objects.add(ingredient, 4)
+        self.assertEqual(line._state.db, 'default')
+        self.assertEqual(Basket.objects.get(ingredient=ingredient).quantity, 7)
+        self.assertFalse(Basket.objects.using('replica').exists())
@@ -25,9 +25,12 @@ urlpatterns = [
     path('salesprofit/', views.SalesProfitView.as_view(), name='sales_profit'),
     path('salesprofit/reports/', views.ReportView.as_view(), name='report'),
     path('salesprofit/bestsellers', views.BestSellerView.as_view(), name='best_sellers'),
+    path('salesprofit/export/<slug:name>.<slug:format>', views.ExportView.as_view(), name='export'),
     path('stock/', views.StockView.as_view(), name='stock'),
     path('stock/currentstock/', views.CurrentStockView.as_view(), name='current_stock'),
     path('stock/currentstock/update/', views.UpdateStockView.as_view(), name='update_stock'),
+    path('stock/currentstock/stocktake/', views.StockTakeView.as_view(), name='stock_take'),
+    path('stock/currentstock/waste/', views.WasteView.as_view(), name='waste'),
     path('stock/stockedrecipes/', views.StockedRecipes.as_view(), name='stocked_recipes'),
     path('stock/shoppinglist/', views.ShoppingList.as_view(), name='shopping_list'),
     path('stock/shoppinglist/add/<ingredient>', views.CreateBasketView.as_view(), name='add_to_basket'),
@@ -42,4 +45,5 @@ urlpatterns = [
     path('stock/ingredients/orphans/', views.OrphanIngredientView.as_view(), name='orphans'),
     path('stock/orders', views.OrderView.as_view(), name='orders'),
     path('stock/orders/add/', views.CreateOrderView.as_view(), name='create_order'),
+    path('profiler/', views.ProfilerView.as_view(), name='profiler'),
 ]
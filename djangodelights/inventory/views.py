@@ -1,10 +1,13 @@
-from decimal import Decimal
+import json
 
+from django.conf import settings
 from django.contrib.auth import logout
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import F, Sum
-from django.http import HttpResponseRedirect
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.views.generic import TemplateView, ListView, View
@@ -15,11 +18,20 @@ from .forms import IngredientAddForm, IngredientEditForm
 from .forms import AddForm, BasketAddForm, BasketUpdateForm, EditBasketFormset
 from .forms import PurchaseAddForm, PurchaseEditForm
 from .forms import RecipeAddForm
-from .forms import UpdateMenuFormSet, UpdateStockFormset
+from .forms import UpdateMenuFormSet, UpdateStockFormset, StockTakeForm, WasteForm
 from .forms import CreateOrderForm, UpdateMenuDetailsFormSet
 from .forms import TableOrderAddForm
+from .forms import DateFilterForm, SalesFilterForm, BestSellerFilterForm
+from .forms import ExportFilterForm
 from .models import Basket, MenuItem, Ingredient, Recipe, Purchase, OrderNumber, Order
 from .models import TableOrder
+from .exports import EXPORTS, FORMATS, export_lines
+from .live import STREAM_PATH
+from .menu import menu_sections
+from .pagination import KeysetPaginationMixin
+from .profiler import stats
+from .routers import ReportingMixin
+from .stocktake import apply_stock_take, diff_stock_take, read_json
 
 
 class SignUp(CreateView):
@@ -78,13 +90,16 @@ class DeleteIngredientView(LoginRequiredMixin, DeleteView):
         return ingredient
 
 
-class MenuView(LoginRequiredMixin, ListView):
-    model = MenuItem
+class MenuView(LoginRequiredMixin, TemplateView):
     template_name = 'inventory/menu.html'
 
     # only display dishes marked for display
-    def get_queryset(self):
-        return MenuItem.objects.filter(display=True)
+    # menu_sections is called by the template, so not when the menu is cached
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['sections'] = menu_sections
+        context['live_url'] = STREAM_PATH
+        return context
 
 
 class CreateMenuView(LoginRequiredMixin, CreateView):
@@ -183,6 +198,9 @@ class BasketView(LoginRequiredMixin, ListView):
     model = Basket
     template_name = 'inventory/basket.html'
 
+    def get_queryset(self):
+        return Basket.objects.select_related('ingredient')
+
 
 # add any ingredient
 class AddBasketView(LoginRequiredMixin, CreateView):
@@ -190,18 +208,12 @@ class AddBasketView(LoginRequiredMixin, CreateView):
     template_name = 'inventory/add_basket.html'
     form_class = AddForm
 
-    # horrible hack for create_or_update
+    # adds to the ingredient's basket line if it already has one
     def form_valid(self, form):
-        ingredient = form.instance.ingredient
-        quantity = form.instance.quantity
-        if ingredient.in_basket():
-            # amend quantity
-            basket_obj = get_object_or_404(Basket, ingredient=ingredient)
-            basket_obj.change_quantity(quantity)
-            return HttpResponseRedirect(reverse('basket_view'))
-        else:
-            # add ingredient
-            return super().form_valid(form)
+        Basket.objects.add(
+            form.cleaned_data['ingredient'], form.cleaned_data['quantity']
+        )
+        return HttpResponseRedirect(reverse('basket_view'))
 
 
 # add item from restock list
@@ -212,10 +224,12 @@ class CreateBasketView(LoginRequiredMixin, CreateView):
     success_url = '/stock/shoppinglist/'
 
     # add ingredient after valid form is posted
-    # this would overwrite form if field was exposed
+    # adds to the basket line if the ingredient is already in the basket
     def form_valid(self, form):
-        form.instance.ingredient = self.get_object()
-        return super().form_valid(form)
+        self.object = Basket.objects.add(
+            self.get_object(), form.cleaned_data['quantity']
+        )
+        return HttpResponseRedirect(self.get_success_url())
 
     # put ingredient into context
     def get_context_data(self, **kwargs):
@@ -232,7 +246,8 @@ class CreateBasketView(LoginRequiredMixin, CreateView):
     # overriding get_object() means no need to slug_the_url_conf
     def get_object(self, queryset=None):
         name = self.kwargs['ingredient']
-        ingredient = get_object_or_404(Ingredient, name=name)
+        ingredients = Ingredient.objects.with_shopping()
+        ingredient = get_object_or_404(ingredients, name=name)
         return ingredient
 
 
@@ -244,10 +259,12 @@ class UpdateBasketView(LoginRequiredMixin, UpdateView):
     success_url = '/stock/shoppinglist/'
 
     # override form to add quantity to amount already in basket
+    # a change that would take the line below zero is refused
     def form_valid(self, form):
-        in_basket = self.get_object().quantity
-        form.instance.quantity += in_basket
-        return super().form_valid(form)
+        if not self.object.change_quantity(form.cleaned_data['quantity']):
+            form.add_error('quantity', 'Not enough in the basket to take away')
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
     # put ingredient into context
     def get_context_data(self, **kwargs):
@@ -285,9 +302,22 @@ class EditBasketView(LoginRequiredMixin, FormView):
 
 
 # view orders
-class OrderView(LoginRequiredMixin, ListView):
+# newest order first, paged by order number, optionally filtered by date
+class OrderView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Order
     template_name = 'inventory/orders.html'
+    paginate_by = 100
+    keyset_ordering = ('-order_number_id', 'id')
+
+    def get_queryset(self):
+        self.form = DateFilterForm(self.request.GET or None)
+        orders = Order.objects.for_period(**self.form.period())
+        return orders.select_related('order_number')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = self.form
+        return context
 
 
 # creates an order_number and then flushes basket into orders
@@ -301,9 +331,11 @@ class CreateOrderView(LoginRequiredMixin, CreateView):
 # Customer orders in restuarant #
 #################################
 # view purchases in a particular table_order
-class PurchaseView(LoginRequiredMixin, ListView):
+class PurchaseView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Purchase
     template_name = 'inventory/purchase.html'
+    paginate_by = 100
+    keyset_ordering = ('menu_item_name', 'id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -311,12 +343,18 @@ class PurchaseView(LoginRequiredMixin, ListView):
         return context
 
     def get_object(self):
-        return get_object_or_404(TableOrder, id=self.kwargs['pk'])
+        if not hasattr(self, 'table_order'):
+            self.table_order = get_object_or_404(TableOrder, id=self.kwargs['pk'])
+        return self.table_order
 
     def get_queryset(self):
         return Purchase.objects.filter(table_order=self.get_object())
 
 
+# the stock couldn't be changed, e.g. another order held it too long
+STOCK_UNAVAILABLE = 'Stock could not be updated just now, please try again'
+
+
 # Create Purchase objects and fill in table_order field
 class CreatePurchaseView(LoginRequiredMixin, CreateView):
     model = Purchase
@@ -327,9 +365,16 @@ class CreatePurchaseView(LoginRequiredMixin, CreateView):
         # add table_order
         table_order = get_object_or_404(TableOrder, id=self.kwargs['pk'])
         form.instance.table_order = table_order
-        # decrease stock
-        form.instance.menu_item.adjust_stock(-form.instance.quantity)
-        return super().form_valid(form)
+        # decrease stock and save purchase together or not at all
+        try:
+            with transaction.atomic():
+                if not form.instance.menu_item.adjust_stock(-form.instance.quantity):
+                    form.add_error('quantity', 'Not enough stock for this order')
+                    return self.form_invalid(form)
+                return super().form_valid(form)
+        except DatabaseError:
+            form.add_error(None, STOCK_UNAVAILABLE)
+            return self.form_invalid(form)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -356,8 +401,15 @@ class UpdatePurchaseView(LoginRequiredMixin, UpdateView):
     # adjust stock up or down by difference between form and model
     def form_valid(self, form):
         delta = self.get_object().quantity - form.instance.quantity
-        self.get_object().menu_item.adjust_stock(delta)
-        return super().form_valid(form)
+        try:
+            with transaction.atomic():
+                if not self.get_object().menu_item.adjust_stock(delta):
+                    form.add_error('quantity', 'Not enough stock for this order')
+                    return self.form_invalid(form)
+                return super().form_valid(form)
+        except DatabaseError:
+            form.add_error(None, STOCK_UNAVAILABLE)
+            return self.form_invalid(form)
 
     # overriding get_object() means no need to slug_the_url_conf
     def get_object(self, queryset=None):
@@ -374,10 +426,12 @@ class DeletePurchaseView(LoginRequiredMixin, DeleteView):
     # increase stock if purchase is deleted
     def delete(self, *args, **kwargs):
         purchase_obj = self.get_object()
-        # only adjust quantity of menu_item exists and 'restock' is checked
-        if purchase_obj.menu_item and self.restock:
-            purchase_obj.menu_item.adjust_stock(purchase_obj.quantity)
-        return super().delete(*args, **kwargs)
+        # restock and delete together or not at all
+        with transaction.atomic():
+            # only adjust quantity of menu_item exists and 'restock' is checked
+            if purchase_obj.menu_item and self.restock:
+                purchase_obj.menu_item.adjust_stock(purchase_obj.quantity)
+            return super().delete(*args, **kwargs)
 
     # overriding get_object() means no need to slug_the_url_conf
     def get_object(self, queryset=None):
@@ -402,7 +456,8 @@ class MenuDetailsView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         title = self.kwargs['menu_item']
-        return Recipe.objects.filter(menu_item__title=title)
+        recipe = Recipe.objects.filter(menu_item__title=title)
+        return recipe.select_related('ingredient')
 
     def get_context_data(self, **kwargs):
         title = self.kwargs['menu_item']
@@ -441,58 +496,60 @@ class SalesProfitView(LoginRequiredMixin, TemplateView):
     template_name = "inventory/sales_profit.html"
 
 
-class ReportView(LoginRequiredMixin, ListView):
-    model = Purchase
+class ReportView(LoginRequiredMixin, ReportingMixin, TemplateView):
     template_name = 'inventory/report.html'
 
-    def get_queryset(self):
-        try:
-            purchases = Purchase.objects.all()
-            # revenue
-            total = Sum(F('menu_item__price') * F('quantity'))
-            revenue = purchases.aggregate(total=total)['total']
-            # costs
-            orders = [
-                obj.quantity * obj.menu_item.dish_cost() for obj in purchases
-            ]
-            self.orders_cost = sum(orders)
-            # profit
-            self.profit = revenue - self.orders_cost
-            # format for display
-            revenue = revenue.quantize(Decimal('0.01'))
-            self.orders_cost = self.orders_cost.quantize(Decimal('0.01'))
-            self.profit = self.profit.quantize(Decimal('0.01'))
-        except:
-            revenue = Decimal(0).quantize(Decimal('0.01'))
-            self.orders_cost = Decimal(0).quantize(Decimal('0.01'))
-            self.profit = Decimal(0).quantize(Decimal('0.01'))
-
-        return revenue
-
+    # revenue, cost and profit in one aggregate query
+    # optionally filtered by date range and table
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['orders'] = self.orders_cost
-        context['profit'] = self.profit
+        form = SalesFilterForm(self.request.GET or None)
+        purchases = Purchase.objects.for_period(**form.period())
+        totals = purchases.sales_totals()
+        context['form'] = form
+        context['revenue'] = totals['revenue']
+        context['orders'] = totals['cost']
+        context['profit'] = totals['profit']
         return context
 
 
-class BestSellerView(LoginRequiredMixin, ListView):
-    model = Purchase
+class BestSellerView(LoginRequiredMixin, ReportingMixin, TemplateView):
     template_name = 'inventory/best_sellers.html'
 
-    def get_queryset(self):
-        # dict comprehension of menu_item__title and aggregated quantity
-        field = 'menu_item__title'
-        titles = Purchase.objects.order_by().values(field).distinct()
-        total = Sum(F('quantity'))
-        result = {
-            key[field]: Purchase.objects.filter(menu_item__title=key[field])
-            .aggregate(total=total)['total'] for key in titles
-        }
+    # top-N dishes by quantity sold and by revenue
+    # optionally filtered by time window and table
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = BestSellerFilterForm(self.request.GET or None)
+        by_quantity, by_revenue = self.rankings(form)
+        context['form'] = form
+        context['by_quantity'] = by_quantity
+        context['by_revenue'] = by_revenue
+        return context
 
-        # find menu_item with highest quantity and return it
-        best_seller = max(result, key=lambda key:result[key])
-        return {best_seller: result[best_seller]}
+    # the form's top-N dishes by quantity and by revenue
+    def rankings(self, form):
+        purchases = Purchase.objects.for_period(**form.period())
+        return [
+            purchases.best_sellers(by, form.limit()) for by in ('quantity', 'revenue')
+        ]
+
+
+# streams purchases, shopping orders or stock as csv or ndjson
+# takes the report filters, plus ?after=<id> to resume an export
+class ExportView(LoginRequiredMixin, ReportingMixin, View):
+    def get(self, request, name, format):
+        if name not in EXPORTS or format not in FORMATS:
+            raise Http404('No such export')
+        form = ExportFilterForm(request.GET or None)
+        if form.is_bound and not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        response = StreamingHttpResponse(
+            export_lines(name, format, **form.options()),
+            content_type=FORMATS[format][1],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{name}.{format}"'
+        return response
 
 
 class StockView(LoginRequiredMixin, TemplateView):
@@ -514,9 +571,64 @@ class UpdateStockView(LoginRequiredMixin, FormView):
     form_class = UpdateStockFormset
     success_url = '/stock/currentstock/'
 
-    # have to to this with formset
+    # changed quantities are applied as a stock take,
+    # so they are written in one query and recorded
     def form_valid(self, form):
-        form.save()
+        rows = [
+            (item.instance.name, item.cleaned_data['quantity'])
+            for item in form.forms if item.has_changed()
+        ]
+        if rows:
+            apply_stock_take(diff_stock_take(rows), self.request.user)
+        return super().form_valid(form)
+
+
+# Upload counted stock as CSV, check the differences, then apply them all
+# at once; or POST {"rows": [...], "apply": true} as JSON for the diff
+class StockTakeView(LoginRequiredMixin, FormView):
+    template_name = 'inventory/stock_take.html'
+    form_class = StockTakeForm
+    success_url = '/stock/currentstock/'
+
+    def post(self, request, *args, **kwargs):
+        if request.content_type == 'application/json':
+            return self.post_json(request)
+        return super().post(request, *args, **kwargs)
+
+    # show the diff, or apply it when confirmed
+    def form_valid(self, form):
+        diff = diff_stock_take(form.cleaned_data['counted'])
+        if 'apply' in self.request.POST and diff.is_valid():
+            apply_stock_take(diff, self.request.user)
+            return HttpResponseRedirect(self.get_success_url())
+        confirm = StockTakeForm(initial={'rows': json.dumps(dict(diff.rows()))})
+        context = self.get_context_data(form=confirm, diff=diff)
+        return self.render_to_response(context)
+
+    def post_json(self, request):
+        try:
+            data = json.loads(request.body)
+            diff = diff_stock_take(read_json(data.get('rows', [])))
+        except (ValueError, AttributeError):
+            return JsonResponse({'errors': ['Invalid JSON body']}, status=400)
+        except ValidationError as e:
+            return JsonResponse({'errors': e.messages}, status=400)
+        result = diff.as_dict()
+        if not diff.is_valid():
+            return JsonResponse(result, status=400)
+        if data.get('apply'):
+            result['stock_take'] = apply_stock_take(diff, request.user).pk
+        return JsonResponse(result)
+
+
+# take wasted stock off and record it in the stock ledger
+class WasteView(LoginRequiredMixin, FormView):
+    template_name = 'inventory/waste.html'
+    form_class = WasteForm
+    success_url = '/stock/currentstock/'
+
+    def form_valid(self, form):
+        form.cleaned_data['ingredient'].waste(form.cleaned_data['quantity'])
         return super().form_valid(form)
 
 
@@ -525,9 +637,7 @@ class StockedRecipes(LoginRequiredMixin, ListView):
     template_name = "inventory/stocked_recipes.html"
 
     def get_queryset(self):
-        menu = MenuItem.objects.all()
-        stocked = [obj for obj in menu if obj.stock_item]
-        return stocked
+        return MenuItem.objects.filter(stock_item=True).with_availability()
 
 
 class ShoppingList(LoginRequiredMixin, ListView):
@@ -535,9 +645,7 @@ class ShoppingList(LoginRequiredMixin, ListView):
     template_name = "inventory/shopping_list.html"
 
     def get_queryset(self):
-        ingredients = Ingredient.objects.all()
-        self.shopping_list = [obj for obj in ingredients if obj.buy()]
-        return self.shopping_list
+        return Ingredient.objects.shopping_list()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -549,8 +657,9 @@ class OrphanIngredientView(LoginRequiredMixin, ListView):
     model = Ingredient
     template_name = "inventory/orphans.html"
 
+    # both lists come from one annotated query
     def get_queryset(self):
-        ingredients = Ingredient.objects.all()
+        ingredients = Ingredient.objects.with_recipe_counts()
         self.no_recipe = [obj for obj in ingredients if obj.no_recipe()]
         non_stock = [obj for obj in ingredients if obj.non_stock()]
         return non_stock
@@ -564,9 +673,21 @@ class OrphanIngredientView(LoginRequiredMixin, ListView):
 ############################################
 # These three views handle customer orders #
 ############################################
-class TableOrderView(LoginRequiredMixin, ListView):
+# newest first, paged by timestamp, optionally filtered by date and table
+class TableOrderView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = TableOrder
     template_name = 'inventory/table_order.html'
+    paginate_by = 50
+    keyset_ordering = ('-timestamp', '-id')
+
+    def get_queryset(self):
+        self.form = SalesFilterForm(self.request.GET or None)
+        return TableOrder.objects.for_period(**self.form.period())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = self.form
+        return context
 
 
 class CreateTableOrderView(LoginRequiredMixin, CreateView):
@@ -581,3 +702,15 @@ class DeleteTableOrderView(LoginRequiredMixin, DeleteView):
 
     def get_success_url(self):
         return reverse('table_order')
+
+
+# staff only report of the query profiler's per-view aggregate
+class ProfilerView(LoginRequiredMixin, UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse({
+            'enabled': settings.INVENTORY_PROFILER,
+            'views': stats.report(),
+        })